@@ -0,0 +1,43 @@
+"""Measure the heap retained by closures with and without flat closures.
+
+Usage: python3 bench_closures.py [count]
+
+Each closure returned by outer refers only to the length of a fresh
+1000-element list.  When it captures its whole defining frame, every list
+stays alive for as long as the closure does."""
+
+import sys
+import tracemalloc
+
+import scheme
+from scheme_reader import Buffer, scheme_read
+from scheme_tokens import tokenize_lines
+
+PROGRAM = """
+(define (outer items)
+  (define total (length items))
+  (lambda () total))
+(define (collect n)
+  (if (= n 0) nil (cons (outer (iota 1000)) (collect (- n 1)))))
+(define closures (collect {0}))
+"""
+
+def retained(flat, count):
+    """The bytes still allocated after building COUNT closures."""
+    scheme.FLAT_CLOSURES = flat
+    env = scheme.create_global_frame()
+    src = Buffer(tokenize_lines(PROGRAM.format(count).split("\n")))
+    tracemalloc.start()
+    while src.current() is not None:
+        scheme.scheme_eval(scheme_read(src), env)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    whole = retained(False, count)
+    flat = retained(True, count)
+    print("whole frames: {0:>12,} bytes".format(whole))
+    print("flat:         {0:>12,} bytes".format(flat))
+    print("ratio:        {0:>12.1f}x".format(whole / flat))
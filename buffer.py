@@ -1,6 +1,7 @@
 """The buffer module assists in iterating through lines and tokens."""
 
 import math
+from collections import deque
 
 class Buffer(object):
     """A Buffer provides a way of accessing a sequence of tokens across lines.
@@ -16,8 +17,9 @@ class Buffer(object):
     In addition, Buffer provides a current method to look at the
     next item to be supplied, without sequencing past it.
 
-    The __str__ method prints all tokens read so far, up to the end of the
-    current line, and marks the current token with >>.
+    The __str__ method prints the tokens of the current line and up to three
+    lines before it, and marks the current token with >>.  Earlier lines are
+    not kept.
 
     >>> buf = Buffer(iter([['(', '+'], [15], [12, ')']]))
     >>> buf.pop()
@@ -49,7 +51,8 @@ class Buffer(object):
     """
     def __init__(self, source):
         self.index = 0
-        self.lines = []
+        self.lines = deque(maxlen=4)
+        self.line_count = 0
         self.source = source
         self.current_line = ()
         self.current()
@@ -72,6 +75,7 @@ class Buffer(object):
             try:
                 self.current_line = next(self.source)
                 self.lines.append(self.current_line)
+                self.line_count += 1
             except StopIteration:
                 self.current_line = ()
                 return None
@@ -80,13 +84,15 @@ class Buffer(object):
     def __str__(self):
         """Return recently read contents; current element marked with >>."""
         # Format string for right-justified line numbers
-        n = len(self.lines)
+        n = self.line_count
         msg = '{0:>' + str(math.floor(math.log10(n))+1) + "}: "
 
         # Up to three previous lines and current line are included in output
         s = ''
-        for i in range(max(0, n-4), n-1):
-            s += msg.format(i+1) + ' '.join(map(str, self.lines[i])) + '\n'
+        previous = list(self.lines)[:-1]
+        for i, line in enumerate(previous):
+            s += msg.format(n - len(previous) + i)
+            s += ' '.join(map(str, line)) + '\n'
         s += msg.format(n)
         s += ' '.join(map(str, self.current_line[:self.index]))
         s += ' >> '
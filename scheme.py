@@ -5,7 +5,15 @@ eval/apply mutual recurrence, environment model, and read-eval-print loop.
 from scheme_primitives import *
 from scheme_reader import *
 from ucb import main, trace
+import itertools
+import os
+import pickle
 import string
+import time
+import weakref
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import Future as PoolFuture
+from concurrent.futures.process import BrokenProcessPool
 
 ##############
 # Eval/Apply #
@@ -35,21 +43,20 @@ def scheme_eval(expr, env):
     first, rest = expr.first, expr.second
 
     # Evaluate Combinations
-    if first in LOGIC_FORMS:
-        return scheme_eval(LOGIC_FORMS[first](rest, env), env)
-    elif first == "lambda":
-        return do_lambda_form(rest, env)
-    elif first == "mu":
-        return do_mu_form(rest)
-    elif first == "define":
-        return do_define_form(rest, env)
-    elif first == "quote":
-        return do_quote_form(rest)
-    elif first == "let":
-        expr, env = do_let_form(rest, env)
-        return scheme_eval(expr, env)
+    form = special_form(first)
+    if form is not None:
+        kind, handler = form
+        if kind is VALUE_FORM:
+            return handler(rest, env)
+        elif kind is TAIL_FORM:
+            return scheme_eval(handler(rest, env), env)
+        else:
+            expr, env = handler(rest, env)
+            return scheme_eval(expr, env)
     else:
         procedure = scheme_eval(first, env)
+        if isinstance(procedure, Macro):
+            return scheme_eval(expand_macro(procedure, expr), env)
         args = rest.map(lambda operand: scheme_eval(operand, env))
         return scheme_apply(procedure, args, env)
 
@@ -57,14 +64,19 @@ def scheme_apply(procedure, args, env):
     """Apply Scheme PROCEDURE to argument values ARGS in environment ENV."""
     if isinstance(procedure, PrimitiveProcedure):
         return apply_primitive(procedure, args, env)
-    elif isinstance(procedure, LambdaProcedure):
+    return apply_values(procedure, scheme_values(args), env)
+
+def apply_values(procedure, args, env):
+    """Apply non-primitive Scheme PROCEDURE to the Python list ARGS in
+    environment ENV."""
+    if isinstance(procedure, LambdaProcedure):
         "*** YOUR CODE HERE ***"
-        new_frame = procedure.env
-        new_frame = new_frame.make_call_frame(procedure.formals, args)
+        new_frame = Frame(procedure.env, bind_formals(procedure.names, args))
+        new_frame.analysis = procedure.analysis
         return scheme_eval(procedure.body, new_frame)
     elif isinstance(procedure, MuProcedure):
         "*** YOUR CODE HERE ***"
-        new_frame = env.make_call_frame(procedure.formals, args)
+        new_frame = Frame(env, bind_formals(procedure.names, args))
         return scheme_eval(procedure.body, new_frame)
     else:
         # print(repr(procedure))
@@ -80,8 +92,7 @@ def apply_primitive(procedure, args, env):
     4
     """
     "*** YOUR CODE HERE ***"
-    args_list = []
-    args.map(lambda num: args_list.append(num))
+    args_list = scheme_values(args)
     if procedure.use_env == True:
         args_list.append(env)
     try:
@@ -94,12 +105,22 @@ def apply_primitive(procedure, args, env):
 ################
 
 class Frame(object):
-    """An environment frame binds Scheme symbols to Scheme values."""
+    """An environment frame binds Scheme symbols to Scheme values.  If known,
+    analysis is the BodyAnalysis of the body evaluated in the frame, which
+    lists the names that it may define there; None means that it may define
+    any name.  A frame is escaped once a procedure or promise refers to it,
+    after which it may be used after the evaluation that created it
+    finishes."""
 
-    def __init__(self, parent):
-        """An empty frame with a PARENT frame (that may be None)."""
-        self.bindings = {}
+    __slots__ = ("bindings", "parent", "analysis", "escaped")
+
+    def __init__(self, parent, bindings=None):
+        """A frame with a PARENT frame (that may be None) and a dictionary of
+        BINDINGS (empty by default)."""
+        self.bindings = {} if bindings is None else bindings
         self.parent = parent
+        self.analysis = None
+        self.escaped = False
 
     def __repr__(self):
         if self.parent is None:
@@ -111,13 +132,32 @@ class Frame(object):
     def lookup(self, symbol):
         """Return the value bound to SYMBOL.  Errors if SYMBOL is not found."""
         "*** YOUR CODE HERE ***"
-        if symbol in self.bindings.keys():
-            return self.bindings[symbol]
-        else:
-            if self.parent is not None:
-                return self.parent.lookup(symbol)
-            else:
-                raise SchemeError("unknown identifier: {0}".format(str(symbol)))
+        frame = self
+        while frame is not None:
+            bindings = frame.bindings
+            if symbol in bindings:
+                return bindings[symbol]
+            frame = frame.parent
+        if isinstance(symbol, Alias):
+            return symbol.env.lookup(symbol.name)
+        raise SchemeError("unknown identifier: {0}".format(str(symbol)))
+
+    def __reduce__(self):
+        # A global frame is not sent between processes; see home_frame
+        if self.parent is None:
+            return (home_frame, ())
+        return (Frame, (None,),
+                (self.bindings, self.parent, self.analysis, self.escaped))
+
+    def __setstate__(self, state):
+        self.bindings, self.parent, self.analysis, self.escaped = state
+
+    def mark_escaped(self):
+        """Mark this frame and all of its parents as escaped."""
+        e = self
+        while e.parent is not None and not e.escaped:
+            e.escaped = True
+            e = e.parent
 
     def global_frame(self):
         """The global environment at the root of the parent chain."""
@@ -174,8 +214,10 @@ class LambdaProcedure(object):
         expressions, such as (lambda (x) (display x) (+ x 1)) can be handled by
         using (begin (display x) (+ x 1)) as the body."""
         self.formals = formals
+        self.names = formal_tuple(formals)
         self.body = body
         self.env = env
+        self.analysis = None
 
     def __str__(self):
         return "(lambda {0} {1})".format(str(self.formals), str(self.body))
@@ -202,6 +244,7 @@ class MuProcedure(object):
         containing multiple expressions, such as (mu (x) (display x) (+ x 1))
         can be handled by using (begin (display x) (+ x 1)) as the body."""
         self.formals = formals
+        self.names = formal_tuple(formals)
         self.body = body
 
     def __str__(self):
@@ -215,19 +258,29 @@ class MuProcedure(object):
 # Special forms #
 #################
 
-def do_lambda_form(vals, env):
-    """Evaluate a lambda form with parameters VALS in environment ENV."""
+def do_lambda_form(vals, env, name=None):
+    """Evaluate a lambda form with parameters VALS in environment ENV.  NAME
+    is the symbol that the procedure is about to be defined as, if any."""
     check_form(vals, 2)
     formals = vals[0]
     check_formals(formals)
     "*** YOUR CODE HERE ***"
+    analysis = analyze_body(formal_names(formals), vals.second)
+    closure = closure_env(analysis, env, name)
     if len(vals) > 2:
         # Lambda expressions containing multiple expressions
         # eg (lambda (x) (display x) (+ x 1)) -> (lambda (x) (begin (display x) (+ x 1)))
-        new_vals = Pair("begin", vals.second)
-        return LambdaProcedure(formals, new_vals, env)
+        new_vals = Pair(Symbol("begin"), vals.second)
+        procedure = LambdaProcedure(formals, new_vals, closure)
     else:
-        return LambdaProcedure(formals, vals.second.first, env)
+        procedure = LambdaProcedure(formals, vals.second.first, closure)
+    procedure.analysis = analysis
+    if closure is env:
+        env.mark_escaped()
+    elif closure.parent is not None and name in closure.bindings:
+        # A recursive procedure refers to itself
+        closure.bindings[name] = procedure
+    return procedure
 
 def do_mu_form(vals):
     """Evaluate a mu form with parameters VALS."""
@@ -236,7 +289,7 @@ def do_mu_form(vals):
     check_formals(formals)
     "*** YOUR CODE HERE ***"
     if len(vals) > 2:
-        new_vals = Pair("begin", vals.second)
+        new_vals = Pair(Symbol("begin"), vals.second)
         return MuProcedure(formals, new_vals)
     else:
         return MuProcedure(formals, vals.second.first)
@@ -253,7 +306,9 @@ def do_define_form(vals, env):
     elif isinstance(target, Pair):
         "*** YOUR CODE HERE ***"
         check_formals(target)
-        env.bindings[target.first] = do_lambda_form(Pair(target.second, vals.second), env)
+        lambda_vals = Pair(target.second, vals.second)
+        env.bindings[target.first] = do_lambda_form(lambda_vals, env,
+                                                    target.first)
         """
         print("")
         print("Lambda formals: " + repr(lambda_formals))
@@ -271,12 +326,119 @@ def do_define_form(vals, env):
     else:
         raise SchemeError("bad argument to define")
 
+def do_define_memoized_form(vals, env):
+    """Evaluate a define-memoized form with parameters VALS in environment
+    ENV, which defines a procedure like define whose results are cached."""
+    check_form(vals, 2)
+    target = vals[0]
+    if not isinstance(target, Pair):
+        raise SchemeError("bad argument to define-memoized")
+    check_formals(target)
+    procedure = do_lambda_form(Pair(target.second, vals.second), env)
+    env.bindings[target.first] = MemoizedProcedure(procedure)
+
 def do_quote_form(vals):
     """Evaluate a quote form with parameters VALS."""
     check_form(vals, 1, 1)
     "*** YOUR CODE HERE ***"
     return vals.first
 
+def do_quasiquote_form(vals, env):
+    """Evaluate a quasiquote form with parameters VALS in environment ENV.
+    Its template is compiled once, by compile_quasiquote."""
+    check_form(vals, 1, 1)
+    plan = _quasiquote_plans.get(vals)
+    if plan is None:
+        plan = _quasiquote_plans[vals] = compile_quasiquote(vals.first, 1)
+    return build_quasiquote(plan, env)
+
+# Compiled quasiquote templates, keyed by the parameters of their form
+_quasiquote_plans = weakref.WeakKeyDictionary()
+
+def compile_quasiquote(template, depth):
+    """Compile the quasiquoted TEMPLATE, nested DEPTH quasiquotes deep, into a
+    plan for build_quasiquote.  A plan is one of
+
+      ('const', value): VALUE itself, shared rather than copied
+      ('eval', expr): the value of an unquoted EXPR
+      ('cons', first, second): a new pair of the values of two plans
+      ('splice', expr, rest): the list value of EXPR followed by REST
+      ('vector', items): a vector of the elements of the list plan ITEMS
+
+    so that only the parts of the template containing unquotes are rebuilt.
+
+    >>> plan = compile_quasiquote(read_line("(a (b c) ,d)"), 1)
+    >>> plan[1]
+    ('const', 'a')
+    >>> plan[2][1]
+    ('const', Pair('b', Pair('c', nil)))
+    >>> plan[2][2]
+    ('cons', ('eval', 'd'), ('const', nil))
+    """
+    if isinstance(template, Vector):
+        items = compile_quasiquote(scheme_list(*template.items), depth)
+        if items[0] == 'const':
+            return ('const', template)
+        return ('vector', items)
+    if not isinstance(template, Pair):
+        return ('const', template)
+    first = template.first
+    if first in ("unquote", "quasiquote"):
+        check_form(template.second, 1, 1)
+        if first == "unquote" and depth == 1:
+            return ('eval', template.second.first)
+        depth += 1 if first == "quasiquote" else -1
+        rest = compile_quasiquote(template.second, depth)
+        if rest[0] == 'const':
+            return ('const', template)
+        return ('cons', ('const', first), rest)
+    rest = compile_quasiquote(template.second, depth)
+    if (isinstance(first, Pair) and first.first == "unquote-splicing" and
+            depth == 1):
+        check_form(first.second, 1, 1)
+        return ('splice', first.second.first, rest)
+    first = compile_quasiquote(first, depth)
+    if first[0] == 'const' and rest[0] == 'const':
+        return ('const', template)
+    return ('cons', first, rest)
+
+def build_quasiquote(plan, env):
+    """Return the value described by a compiled quasiquote PLAN in ENV."""
+    kind = plan[0]
+    if kind == 'const':
+        return plan[1]
+    if kind == 'eval':
+        return scheme_eval(plan[1], env)
+    if kind == 'cons':
+        return Pair(build_quasiquote(plan[1], env),
+                    build_quasiquote(plan[2], env))
+    if kind == 'vector':
+        return scheme_list_to_vector(build_quasiquote(plan[1], env))
+    spliced = scheme_eval(plan[1], env)
+    rest = build_quasiquote(plan[2], env)
+    if rest is nil:
+        return spliced
+    return scheme_append(spliced, rest)
+
+def do_delay_form(vals, env, chained=False):
+    """Evaluate a delay form with parameters VALS in environment ENV, or a
+    delay-force form if CHAINED."""
+    check_form(vals, 1, 1)
+    expr = vals.first
+    env.mark_escaped()
+    return Promise(lambda: scheme_eval(expr, env), chained)
+
+def do_future_form(vals, env):
+    """Evaluate a future form with parameters VALS in environment ENV, which
+    starts evaluating its expression in a worker process."""
+    check_form(vals, 1, 1)
+    return start_future(do_lambda_form(Pair(nil, vals), env), env)
+
+def do_cons_stream_form(vals, env):
+    """Evaluate a cons-stream form with parameters VALS in environment ENV."""
+    check_form(vals, 2, 2)
+    return Pair(scheme_eval(vals.first, env), do_delay_form(vals.second, env))
+
 def do_let_form(vals, env):
     """Evaluate a let form with parameters VALS in environment ENV."""
     check_form(vals, 2)
@@ -286,25 +448,25 @@ def do_let_form(vals, env):
         raise SchemeError("bad bindings list in let form")
 
     # Add a frame containing bindings
-    names, vals = nil, nil
     "*** YOUR CODE HERE ***"
-    """
-    while len(bindings) > 0:
-        new_env.define(bindings.first.first[0], scheme_eval(bindings.first.second[0], new_env))
+    values = {}
+    while bindings is not nil:
+        binding = bindings.first
+        check_form(binding, 2, 2)
+        name = binding.first
+        if not scheme_symbolp(name) or name in values:
+            raise SchemeError("bad binding in let form: {0}".format(
+                str(binding)))
+        values[name] = scheme_eval(binding.second.first, env)
         bindings = bindings.second
-    """
-
-    for binding in bindings:
-        names = Pair(binding.first, names)
-        vals = Pair(scheme_eval(binding.second[0], env), vals)
-        # new_env.define(binding.first[0], scheme_eval(binding.second[0], new_env))
-    new_env = env.make_call_frame(names, vals)
+    new_env = Frame(env, values)
+    new_env.analysis = analyze_body(values.keys(), exprs)
 
     # Evaluate all but the last expression after bindings, and return the last
-    last = len(exprs)-1
-    for i in range(0, last):
-        scheme_eval(exprs[i], new_env)
-    return exprs[last], new_env
+    while exprs.second is not nil:
+        scheme_eval(exprs.first, new_env)
+        exprs = exprs.second
+    return exprs.first, new_env
 
 #########################
 # Logical Special Forms #
@@ -362,7 +524,7 @@ def do_cond_form(vals, env):
             "*** YOUR CODE HERE ***"
             if clause.second:
                 if len(clause.second) > 1:
-                    return Pair("begin", clause.second)
+                    return Pair(Symbol("begin"), clause.second)
                 return clause.second[0]
             return test
 
@@ -413,13 +575,835 @@ def check_formals(formals):
             raise SchemeError("Not a well-formed list of symbols or symbols are repeated.")
         formals = formals.second
 
+def formal_tuple(formals):
+    """The symbols of the Scheme list FORMALS as a tuple, in order."""
+    names = []
+    while formals is not nil:
+        names.append(formals.first)
+        formals = formals.second
+    return tuple(names)
+
+def bind_formals(names, vals):
+    """A dictionary binding each symbol in the tuple NAMES to the
+    corresponding value in the Python list VALS.
+
+    >>> bind_formals(("a", "b"), [1, 2])
+    {'a': 1, 'b': 2}
+    """
+    if len(vals) != len(names):
+        raise SchemeError("wrong number of formal values")
+    return dict(zip(names, vals))
+
+def scheme_values(vals):
+    """The elements of the Scheme list VALS as a Python list."""
+    if isinstance(vals, CompactList):
+        values = vals.elements()
+        if values is not None:
+            return values
+    values = []
+    while vals is not nil:
+        values.append(vals.first)
+        vals = vals.second
+    return values
+
+
+##########
+# Macros #
+##########
+
+class Macro(object):
+    """A macro defined by syntax-rules, which rewrites a form matching one of
+    its patterns into the corresponding template.
+
+    Expansion is hygienic.  Symbols that a template binds with lambda, mu,
+    let or define are renamed in each expansion, so they cannot capture
+    variables of the macro's user.  Other symbols of a template, apart from
+    special form names and quoted data, are replaced by an Alias, so that
+    they refer to variables of the environment where the macro was defined
+    even if the user binds the same names."""
+
+    def __init__(self, literals, rules, env, ellipsis="..."):
+        """A macro with LITERALS, a Python list of symbols matched literally,
+        and RULES, a list of (pattern, template) pairs of Scheme values,
+        defined in environment ENV."""
+        self.literals = literals
+        self.ellipsis = ellipsis
+        self.rules = []
+        for pattern, template in rules:
+            binders = template_binders(template, ellipsis)
+            bound = binders.union(self.pattern_vars(pattern))
+            aliases = {s: Alias(s, env)
+                       for s in template_symbols(template, ellipsis)
+                       if s not in bound}
+            self.rules.append((pattern, template, binders, aliases))
+
+    def __str__(self):
+        literals = scheme_list(*self.literals)
+        return "(syntax-rules {0} ...)".format(str(literals))
+
+    def expand(self, expr):
+        """Return the expansion of EXPR, a use of this macro."""
+        for pattern, template, binders, aliases in self.rules:
+            bindings = {}
+            if self.match(pattern.second, expr.second, bindings):
+                renames = dict(aliases)
+                for b in binders:
+                    if b not in bindings:
+                        renames[b] = fresh_symbol(b)
+                return self.instantiate(template, bindings, renames)
+        raise SchemeError("no syntax rule matches {0}".format(str(expr)))
+
+    def pattern_vars(self, pattern):
+        """The pattern variables in PATTERN."""
+        if scheme_symbolp(pattern):
+            if pattern in self.literals or pattern in ("_", self.ellipsis):
+                return []
+            return [pattern]
+        if isinstance(pattern, Pair):
+            return (self.pattern_vars(pattern.first) +
+                    self.pattern_vars(pattern.second))
+        return []
+
+    def match(self, pattern, form, bindings):
+        """Return whether FORM matches PATTERN, adding the values of pattern
+        variables to the dict BINDINGS.  A variable under an ellipsis is
+        bound to a Python list of its values in each repetition.  A literal
+        also matches an alias of the same name."""
+        if scheme_symbolp(pattern):
+            if pattern in self.literals:
+                return (form == pattern or
+                        isinstance(form, Alias) and form.name == pattern)
+            if pattern != "_":
+                bindings[pattern] = form
+            return True
+        if isinstance(pattern, Pair):
+            rest = pattern.second
+            if isinstance(rest, Pair) and rest.first == self.ellipsis:
+                return self.match_ellipsis(pattern.first, rest.second, form,
+                                           bindings)
+            return (isinstance(form, Pair) and
+                    self.match(pattern.first, form.first, bindings) and
+                    self.match(rest, form.second, bindings))
+        if pattern is nil:
+            return form is nil
+        return scheme_equalp(pattern, form)
+
+    def match_ellipsis(self, repeated, after, form, bindings):
+        """Match FORM against the pattern REPEATED ... followed by AFTER."""
+        min_after = 0
+        tail = after
+        while isinstance(tail, Pair):
+            min_after, tail = min_after + 1, tail.second
+        items = []
+        while isinstance(form, Pair):
+            items.append(form)
+            form = form.second
+        count = len(items) - min_after
+        if count < 0:
+            return False
+        matches = []
+        for item in items[:count]:
+            match = {}
+            if not self.match(repeated, item.first, match):
+                return False
+            matches.append(match)
+        for var in self.pattern_vars(repeated):
+            bindings[var] = [match[var] for match in matches]
+        rest = items[count] if count < len(items) else form
+        return self.match(after, rest, bindings)
+
+    def instantiate(self, template, bindings, renames):
+        """Fill in TEMPLATE with the pattern variable values in BINDINGS,
+        replacing symbols introduced by the template according to RENAMES."""
+        if scheme_symbolp(template):
+            if template in bindings:
+                value = bindings[template]
+                if isinstance(value, list):
+                    raise SchemeError("{0} is missing an ellipsis".format(
+                        template))
+                return value
+            return renames.get(template, template)
+        if not isinstance(template, Pair):
+            return template
+        rest = template.second
+        if not (isinstance(rest, Pair) and rest.first == self.ellipsis):
+            return Pair(self.instantiate(template.first, bindings, renames),
+                        self.instantiate(rest, bindings, renames))
+        names = [v for v in self.pattern_vars(template.first)
+                 if isinstance(bindings.get(v), list)]
+        if not names:
+            raise SchemeError(
+                "no pattern variables before ellipsis in template")
+        counts = {len(bindings[v]) for v in names}
+        if len(counts) > 1:
+            raise SchemeError("mismatched ellipsis lengths in template")
+        items = []
+        for i in range(counts.pop()):
+            step = dict(bindings)
+            for v in names:
+                step[v] = bindings[v][i]
+            items.append(self.instantiate(template.first, step, renames))
+        result = self.instantiate(rest.second, bindings, renames)
+        for item in reversed(items):
+            result = Pair(item, result)
+        return result
+
+_symbol_counter = itertools.count(1)
+
+def fresh_symbol(symbol):
+    """A new symbol named after SYMBOL that cannot be read from source."""
+    return Symbol.uninterned("{0}#{1}".format(symbol, next(_symbol_counter)))
+
+class Alias(Symbol):
+    """A fresh symbol that a macro expansion uses in place of NAME.  Where
+    no frame binds the alias itself, it refers to NAME in ENV, the
+    environment of the macro.  It prints as NAME.
+
+    >>> env = create_global_frame()
+    >>> env.bindings[Symbol("x")] = 1
+    >>> alias = Alias(Symbol("x"), env)
+    >>> print(alias, Frame(env, {Symbol("x"): 2}).lookup(alias))
+    x 1
+    """
+
+    def __new__(cls, name, env):
+        text = "{0}#{1}".format(name, next(_symbol_counter))
+        alias = str.__new__(cls, text)
+        alias.id = next(Symbol._ids)
+        alias.name, alias.env = name, env
+        return alias
+
+    def __str__(self):
+        return str(self.name)
+
+    def __reduce__(self):
+        return (Alias, (self.name, self.env))
+
+# Symbols of a template that are not replaced by aliases
+_TEMPLATE_KEYWORDS = {"else", "unquote", "unquote-splicing"}
+
+def template_symbols(template, ellipsis):
+    """The symbols in TEMPLATE that may refer to variables: those that are
+    not special form names, the ELLIPSIS or in quoted data."""
+    symbols = set()
+    def walk(t, depth):
+        if scheme_symbolp(t):
+            if (depth == 0 and t != ellipsis and t not in _TEMPLATE_KEYWORDS
+                    and special_form(t) is None):
+                symbols.add(t)
+            return
+        if not isinstance(t, Pair):
+            return
+        if t.first == "syntax-rules" or t.first == "quote" and depth == 0:
+            return
+        if t.first == "quasiquote":
+            t, depth = t.second, depth + 1
+        elif t.first in ("unquote", "unquote-splicing") and depth > 0:
+            t, depth = t.second, depth - 1
+        while isinstance(t, Pair):
+            walk(t.first, depth)
+            t = t.second
+        walk(t, depth)
+    walk(template, 0)
+    return symbols
+
+def template_binders(template, ellipsis):
+    """The symbols that TEMPLATE binds as formal parameters or names in
+    lambda, mu, let and define forms."""
+    binders = set()
+    def add_symbols(formals):
+        while isinstance(formals, Pair):
+            if scheme_symbolp(formals.first) and formals.first != ellipsis:
+                binders.add(formals.first)
+            formals = formals.second
+        if scheme_symbolp(formals):
+            binders.add(formals)
+    def walk(t):
+        while isinstance(t, Pair):
+            if isinstance(t.second, Pair):
+                target = t.second.first
+                if t.first in ("lambda", "mu"):
+                    add_symbols(target)
+                elif t.first in ("define", "define-memoized"):
+                    if scheme_symbolp(target):
+                        binders.add(target)
+                    else:
+                        add_symbols(target)
+                elif t.first == "let":
+                    while isinstance(target, Pair):
+                        if isinstance(target.first, Pair):
+                            add_symbols(Pair(target.first.first, nil))
+                        target = target.second
+            walk(t.first)
+            t = t.second
+    walk(template)
+    return binders
+
+# Expansions of each macro use, so that a form is expanded only once
+_expansions = weakref.WeakKeyDictionary()
+
+def expand_macro(macro, expr):
+    """Return the expansion of EXPR, a use of MACRO."""
+    cached = _expansions.get(expr)
+    if cached is not None and cached[0] is macro:
+        return cached[1]
+    expansion = macro.expand(expr)
+    _expansions[expr] = (macro, expansion)
+    return expansion
+
+def do_syntax_rules_form(vals, env):
+    """Evaluate a syntax-rules form with parameters VALS in environment
+    ENV."""
+    check_form(vals, 1)
+    ellipsis = "..."
+    if scheme_symbolp(vals.first):
+        ellipsis, vals = vals.first, vals.second
+        check_form(vals, 1)
+    literals = vals.first
+    if not scheme_listp(literals) or not all(map(scheme_symbolp, literals)):
+        raise SchemeError("bad literals list in syntax-rules")
+    rules = []
+    for rule in vals.second:
+        check_form(rule, 2, 2)
+        if not isinstance(rule.first, Pair):
+            raise SchemeError("bad pattern in syntax-rules: {0}".format(
+                str(rule.first)))
+        rules.append((rule.first, rule.second.first))
+    return Macro(list(literals), rules, env, ellipsis)
+
+def do_define_syntax_form(vals, env):
+    """Evaluate a define-syntax form with parameters VALS in environment
+    ENV."""
+    check_form(vals, 2, 2)
+    name = vals.first
+    if not scheme_symbolp(name):
+        raise SchemeError("bad macro name: {0}".format(str(name)))
+    macro = scheme_eval(vals.second.first, env)
+    if not isinstance(macro, Macro):
+        raise SchemeError("define-syntax of {0} is not a macro".format(name))
+    env.bindings[name] = macro
+
+def do_let_syntax_form(vals, env):
+    """Evaluate a let-syntax form with parameters VALS in environment ENV."""
+    check_form(vals, 2)
+    names, macros = nil, nil
+    for binding in vals.first:
+        check_form(binding, 2, 2)
+        macro = scheme_eval(binding.second.first, env)
+        if not isinstance(macro, Macro):
+            raise SchemeError("let-syntax of {0} is not a macro".format(
+                binding.first))
+        names, macros = Pair(binding.first, names), Pair(macro, macros)
+    new_env = env.make_call_frame(names, macros)
+    exprs = vals.second
+    while exprs.second is not nil:
+        scheme_eval(exprs.first, new_env)
+        exprs = exprs.second
+    return exprs.first, new_env
+
+#################
+# Flat closures #
+#################
+
+# Whether lambda procedures capture only the variables they refer to
+FLAT_CLOSURES = True
+
+# Forms whose uses may refer to any variable visible where they appear
+_UNANALYZABLE = {"eval", "define-syntax", "let-syntax"}
+
+class BodyAnalysis(object):
+    """What free_variables finds in a body evaluated in its own frame.
+
+    free is the set of variables it refers to without binding them, and
+    defined maps the names it defines to the number of times they may be
+    bound in the frame, counting a formal parameter as one; procedures are
+    those that it binds only with (define (name ...) ...).  calls is the set
+    of free variables that it calls anywhere, or None if it calls a
+    procedure that it binds or computes.  frame_calls is the set of
+    variables called by its expressions that are evaluated in the frame
+    rather than in a nested lambda or let, or None if one of those calls a
+    computed procedure."""
+
+    __slots__ = ("free", "defined", "procedures", "calls", "frame_calls")
+
+    def __init__(self, free, defined, procedures, calls, frame_calls):
+        self.free, self.defined, self.procedures = free, defined, procedures
+        self.calls, self.frame_calls = calls, frame_calls
+
+def free_variables(formals, body):
+    """The BodyAnalysis of the Scheme list of expressions BODY evaluated in
+    a frame that binds the set of symbols FORMALS, or None if BODY may refer
+    to variables that do not appear in it.
+
+    >>> a = free_variables({"x"}, read_line(
+    ...     "((define (g y) (+ x y z)) (let ((w 1)) (g w)) (define x (g 2)))"))
+    >>> sorted(a.free), sorted(a.defined.items()), sorted(a.procedures)
+    (['+', 'g', 'z'], [('g', 1), ('x', 2)], ['g'])
+    >>> sorted(a.calls), sorted(a.frame_calls)
+    (['+', 'g'], ['g'])
+    >>> print(free_variables(set(), read_line("((lambda (f) (f)))")).calls)
+    None
+    >>> print(free_variables(set(), read_line("((eval 'x))")))
+    None
+    """
+    free, defined, procedure_defines = set(), {}, {}
+    calls, frame_calls = set(), set()
+    unknown = {}  # "calls" or "frame_calls" once either is unknown
+    def walk_all(exprs, bound, nested):
+        while isinstance(exprs, Pair):
+            walk(exprs.first, bound, nested)
+            exprs = exprs.second
+    def walk_template(template, bound, nested):
+        while isinstance(template, Pair):
+            if (template.first in ("unquote", "unquote-splicing")
+                    and isinstance(template.second, Pair)):
+                walk(template.second.first, bound, nested)
+                return
+            walk_template(template.first, bound, nested)
+            template = template.second
+    def define(name, procedure):
+        defined[name] = defined.get(name, 0) + 1
+        if procedure:
+            procedure_defines[name] = procedure_defines.get(name, 0) + 1
+    def walk(expr, bound, nested):
+        if scheme_symbolp(expr):
+            if expr in _UNANALYZABLE:
+                raise SchemeError(expr)
+            if expr not in bound:
+                free.add(expr)
+            return
+        if not isinstance(expr, Pair):
+            return
+        first, rest = expr.first, expr.second
+        if special_form(first) is not None:
+            if first in _UNANALYZABLE:
+                raise SchemeError(first)
+            if (not isinstance(rest, Pair) or
+                    first in ("quote", "syntax-rules")):
+                return
+            if first == "quasiquote":
+                walk_template(rest.first, bound, nested)
+            elif first in ("lambda", "mu"):
+                walk_all(rest.second, bound | formal_names(rest.first), True)
+            elif first == "let":
+                names, bindings = set(), rest.first
+                while isinstance(bindings, Pair):
+                    if isinstance(bindings.first, Pair):
+                        names.add(bindings.first.first)
+                        walk_all(bindings.first.second, bound, nested)
+                    bindings = bindings.second
+                walk_all(rest.second, bound | names, True)
+            elif first in ("define", "define-memoized"):
+                target = rest.first
+                define(target.first if isinstance(target, Pair) else target,
+                       isinstance(target, Pair))
+                if isinstance(target, Pair):
+                    walk_all(rest.second, bound | formal_names(target.second),
+                             True)
+                else:
+                    walk_all(rest.second, bound, nested)
+            elif first == "cond":
+                for clause in rest:
+                    if isinstance(clause, Pair) and clause.first == "else":
+                        clause = clause.second
+                    walk_all(clause, bound, nested)
+            else:
+                walk_all(rest, bound, nested)
+            return
+        if scheme_symbolp(first):
+            if first in bound:
+                unknown["calls"] = True
+            else:
+                calls.add(first)
+            if not nested:
+                frame_calls.add(first)
+        elif not (isinstance(first, Pair) and first.first == "lambda"):
+            unknown["calls"] = True
+            if not nested:
+                unknown["frame_calls"] = True
+        walk(first, bound, nested)
+        walk_all(rest, bound, nested)
+    try:
+        walk_all(body, set(formals), False)
+    except SchemeError:
+        return None
+    for name in defined.keys() & formals:
+        defined[name] += 1
+    procedures = {name for name, count in procedure_defines.items()
+                  if count == defined[name]}
+    return BodyAnalysis(free, defined, procedures,
+                        None if "calls" in unknown else calls,
+                        None if "frame_calls" in unknown else frame_calls)
+
+# The analysis of a flat closure's frame, which never defines anything
+_FLAT_ANALYSIS = BodyAnalysis(set(), {}, set(), set(), set())
+
+# The results of free_variables for bodies, by their formals (False for None)
+_free_variables = weakref.WeakKeyDictionary()
+
+def analyze_body(formals, body):
+    """The result of free_variables for the set of symbols FORMALS and BODY,
+    computed once for each BODY and FORMALS, or False if it is None."""
+    by_formals = _free_variables.get(body)
+    if by_formals is None:
+        by_formals = _free_variables[body] = {}
+    formals = frozenset(formals)
+    analysis = by_formals.get(formals)
+    if analysis is None:
+        analysis = free_variables(formals, body) or False
+        by_formals[formals] = analysis
+    return analysis
+
+def plain_procedure(value):
+    """Whether VALUE is a procedure that cannot see the frame it is called
+    from: a lambda procedure, or a primitive that is not given it."""
+    return (isinstance(value, LambdaProcedure) or
+            isinstance(value, PrimitiveProcedure) and not value.use_env)
+
+def defines_known(frame):
+    """Whether the analysis of FRAME lists every name that the body evaluated
+    in it may still define there.  A name could also be defined by a macro
+    that its expressions use, or by eval given the frame by a primitive that
+    they call."""
+    analysis = frame.analysis
+    if not analysis or analysis.frame_calls is None:
+        return False
+    for var in analysis.frame_calls:
+        if var in analysis.procedures:
+            continue
+        if analysis.defined.get(var, 0) > 1:
+            return False
+        e = frame
+        while e is not None and var not in e.bindings:
+            e = e.parent
+        if e is None:
+            return False
+        value = e.bindings[var]
+        if (isinstance(value, Macro) or
+                isinstance(value, PrimitiveProcedure) and value.use_env):
+            return False
+    return True
+
+def closure_env(analysis, env, name=None):
+    """The environment for a procedure whose body has the free_variables
+    ANALYSIS, defined in ENV as NAME (if not None).
+
+    It is a frame holding just the values of the non-global variables that
+    the body refers to, so that the procedure does not keep the rest of ENV
+    alive.  ENV itself is returned instead if the body may need more of it,
+    or if a variable's binding could still change.  The body may refer to
+    variables it does not name, or call a procedure that is not a captured
+    plain_procedure: a global may be redefined as a mu procedure, which
+    sees the frames of its caller, or as a macro or eval.  An enclosing
+    frame may yet (re)define a variable the body refers to.  A captured
+    binding for NAME is left for do_lambda_form to fill in."""
+    if not FLAT_CLOSURES or env.parent is None:
+        return env
+    if not analysis or analysis.calls is None:
+        return env
+    frame = env
+    while frame.parent is not None:
+        if not defines_known(frame):
+            return env
+        frame = frame.parent
+    captured = {}
+    for var in analysis.free:
+        if var == name:
+            if env.analysis.defined.get(var, 0) > 1:
+                return env
+            captured[var] = None
+            continue
+        frame = env
+        while var not in frame.bindings and frame.parent is not None:
+            if var in frame.analysis.defined:
+                return env
+            frame = frame.parent
+        if frame.parent is None:
+            if var in analysis.calls:
+                return env
+            continue
+        value = frame.bindings[var]
+        if (frame.analysis.defined.get(var, 0) > 1 or isinstance(value, Macro)
+                or var in analysis.calls and not plain_procedure(value)):
+            return env
+        captured[var] = value
+    if not captured:
+        return env.global_frame()
+    flat = Frame(env.global_frame())
+    flat.bindings = captured
+    flat.analysis = _FLAT_ANALYSIS
+    return flat
+
+################
+# Optimization #
+################
+
+# Primitives that may be called on constant operands before a program runs
+PURE_PRIMITIVES = {
+    "+", "-", "*", "/", "quotient", "modulo", "remainder", "floor", "ceil",
+    "=", "<", ">", "<=", ">=", "even?", "odd?", "zero?", "not", "eq?",
+    "eqv?", "equal?", "boolean?", "number?", "integer?", "symbol?", "null?",
+}
+
+# The original bindings of primitive names, to detect redefinitions
+_primitive_frame = Frame(None)
+add_primitives(_primitive_frame)
+
+# The largest body, counted in pairs, of a procedure that may be inlined
+INLINE_SIZE = 12
+
+def optimize(expr, env):
+    """Return an expression equivalent to EXPR in environment ENV in which
+    calls to pure primitives on constants have been evaluated, if and cond
+    forms with constant tests have been pruned, and calls to small global
+    procedures built only from pure primitives have been inlined.
+
+    A call is folded or inlined only if its operator is not bound by any
+    enclosing form or define in EXPR, and its global binding in ENV is still
+    the original primitive (for folding).  Later redefinitions of folded
+    primitives and inlined procedures do not affect EXPR.
+
+    >>> env = create_global_frame()
+    >>> print(optimize(read_line("(* 2 3.5 10)"), env))
+    70
+    >>> expr = read_line("(lambda (x) (if (< 1 2) (+ x (* 2 3)) (f)))")
+    >>> print(optimize(expr, env))
+    (lambda (x) (+ x 6))
+    >>> expr = read_line("(cond ((odd? 2) a) ((= 1 1) b c) (else d))")
+    >>> print(optimize(expr, env))
+    (begin b c)
+    >>> _ = scheme_eval(read_line("(define (square x) (* x x))"), env)
+    >>> print(optimize(read_line("(+ (square 3) (square y))"), env))
+    (+ 9 (* y y))
+    >>> print(optimize(read_line("(let ((+ -)) (+ 1 2))"), env))
+    (let ((+ -)) (+ 1 2))
+    >>> _ = scheme_eval(read_line("(define (- x y) (display x))"), env)
+    >>> print(optimize(read_line("(- 3 2)"), env))
+    (- 3 2)
+    """
+    return _optimize(expr, env.global_frame(), defined_names(expr))
+
+@primitive("optimize", use_env=True)
+def scheme_optimize(expr, env):
+    """The expression EXPR as the optimization pass rewrites it in ENV."""
+    return optimize(expr, env)
+
+def defined_names(expr):
+    """The set of names defined by define forms anywhere in EXPR."""
+    names = set()
+    while isinstance(expr, Pair):
+        if (expr.first in ("define", "define-memoized") and
+                isinstance(expr.second, Pair)):
+            target = expr.second.first
+            names.add(target.first if isinstance(target, Pair) else target)
+        names |= defined_names(expr.first)
+        expr = expr.second
+    return names
+
+def formal_names(formals):
+    """The set of symbols in the formal parameter list FORMALS."""
+    names = set()
+    while isinstance(formals, Pair):
+        names.add(formals.first)
+        formals = formals.second
+    if scheme_symbolp(formals):
+        names.add(formals)
+    return names
+
+def constant_value(expr):
+    """A one-element tuple holding the value of EXPR if it is a constant,
+    which evaluates to itself or is quoted, or None otherwise."""
+    if scheme_numberp(expr) or expr is nil:
+        return (expr,)
+    if (isinstance(expr, Pair) and expr.first == "quote" and
+            isinstance(expr.second, Pair) and expr.second.second is nil):
+        return (expr.second.first,)
+    return None
+
+def _optimize(expr, globals, bound):
+    """Optimize EXPR given the global frame GLOBALS, in which the set of
+    names BOUND have local bindings."""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return expr
+    first, rest = expr.first, expr.second
+    def each(exprs, bound=bound):
+        return scheme_list(*[_optimize(e, globals, bound) for e in exprs])
+    if first in ("quote", "quasiquote", "define-syntax", "let-syntax",
+                 "syntax-rules"):
+        return expr
+    if first in ("lambda", "mu", "define", "define-memoized"):
+        if not isinstance(rest, Pair):
+            return expr
+        target = rest.first
+        inner = bound
+        if isinstance(target, Pair) and first.startswith("define"):
+            inner = bound | formal_names(target.second) | {target.first}
+        elif first in ("lambda", "mu"):
+            inner = bound | formal_names(target)
+        return Pair(first, Pair(target, each(rest.second, inner)))
+    if first == "let":
+        if not isinstance(rest, Pair) or not scheme_listp(rest.first):
+            return expr
+        bindings, names = [], set()
+        for binding in rest.first:
+            if not isinstance(binding, Pair):
+                return expr
+            bindings.append(Pair(binding.first, each(binding.second)))
+            names.add(binding.first)
+        body = each(rest.second, bound | names)
+        return Pair(first, Pair(scheme_list(*bindings), body))
+    if first == "if" and len(rest) == 3:
+        test = _optimize(rest.first, globals, bound)
+        value = constant_value(test)
+        if value is not None:
+            branch = rest[1] if scheme_true(value[0]) else rest[2]
+            return _optimize(branch, globals, bound)
+        return Pair(first, Pair(test, each(rest.second)))
+    if first == "cond":
+        return _optimize_cond(expr, globals, bound)
+    if first in LOGIC_FORMS or first in ("delay", "delay-force", "future",
+                                         "cons-stream"):
+        return Pair(first, each(rest))
+    if scheme_symbolp(first) and first not in bound:
+        proc = globals.bindings.get(first)
+        if isinstance(proc, Macro):
+            return expr
+        operands = [_optimize(e, globals, bound) for e in rest]
+        if (first in PURE_PRIMITIVES and
+                proc is _primitive_frame.bindings[first]):
+            values = [constant_value(e) for e in operands]
+            if None not in values:
+                try:
+                    result = proc.fn(*[v[0] for v in values])
+                except (SchemeError, TypeError, ArithmeticError):
+                    # Leave the error for the evaluator to report
+                    result = None
+                if scheme_numberp(result):
+                    return result
+        elif (isinstance(proc, LambdaProcedure) and
+              _inlinable(proc, operands, globals, bound)):
+            body = _substitute(proc.body, dict(zip(proc.formals, operands)))
+            return _optimize(body, globals, bound)
+        return Pair(first, scheme_list(*operands))
+    return each(expr)
+
+def _optimize_cond(expr, globals, bound):
+    """Optimize the cond form EXPR, removing clauses whose tests are constant
+    false values and any clauses after one with a constant true test."""
+    clauses = []
+    for clause in expr.second:
+        if not isinstance(clause, Pair) or not scheme_listp(clause):
+            return expr
+        body = scheme_list(*[_optimize(e, globals, bound)
+                             for e in clause.second])
+        if clause.first == "else":
+            if body is nil:
+                return expr
+            clauses.append(Pair(Symbol("else"), body))
+            break
+        test = _optimize(clause.first, globals, bound)
+        value = constant_value(test)
+        if value is None:
+            clauses.append(Pair(test, body))
+        elif scheme_true(value[0]):
+            if body is nil:
+                body = Pair(test, nil)
+            clauses.append(Pair(Symbol("else"), body))
+            break
+    if not clauses:
+        return expr
+    if clauses[0].first == "else":
+        body = clauses[0].second
+        if body.second is nil:
+            return body.first
+        return Pair(Symbol("begin"), body)
+    return Pair(Symbol("cond"), scheme_list(*clauses))
+
+def _inlinable(proc, operands, globals, bound):
+    """Whether a call to the LambdaProcedure PROC on OPERANDS can be replaced
+    by its body: PROC is global, small, and built only from its formals,
+    constants, if forms and calls to unshadowed pure primitives, and its
+    OPERANDS are constants or symbols."""
+    formals = proc.formals
+    if proc.env is not globals or not scheme_listp(formals):
+        return False
+    if len(formals) != len(operands):
+        return False
+    if not all(scheme_symbolp(e) or constant_value(e) for e in operands):
+        return False
+    size = [0]
+    def pure(expr):
+        if scheme_symbolp(expr):
+            return expr in formals
+        if constant_value(expr) is not None:
+            return True
+        if not isinstance(expr, Pair) or not scheme_listp(expr):
+            return False
+        size[0] += len(expr)
+        op = expr.first
+        if op == "if":
+            return len(expr) == 4 and all(pure(e) for e in expr.second)
+        return (op in PURE_PRIMITIVES and op not in bound and
+                globals.bindings.get(op) is _primitive_frame.bindings[op] and
+                all(pure(e) for e in expr.second))
+    return pure(proc.body) and size[0] <= INLINE_SIZE
+
+def _substitute(expr, values):
+    """EXPR with each symbol in the dict VALUES replaced by its value."""
+    if scheme_symbolp(expr):
+        return values.get(expr, expr)
+    if not isinstance(expr, Pair) or constant_value(expr) is not None:
+        return expr
+    return Pair(_substitute(expr.first, values),
+                _substitute(expr.second, values))
 
 ##################
 # Tail Recursion #
 ##################
 
+# Special forms return a value, an expression to evaluate in tail position, or
+# an expression and a new frame to evaluate it in
+VALUE_FORM, TAIL_FORM, FRAME_FORM = "value", "tail", "frame"
+
+SPECIAL_FORM_HANDLERS = {
+    "lambda": (VALUE_FORM, do_lambda_form),
+    "mu": (VALUE_FORM, lambda vals, env: do_mu_form(vals)),
+    "define": (VALUE_FORM, do_define_form),
+    "define-memoized": (VALUE_FORM, do_define_memoized_form),
+    "quote": (VALUE_FORM, lambda vals, env: do_quote_form(vals)),
+    "quasiquote": (VALUE_FORM, do_quasiquote_form),
+    "delay": (VALUE_FORM, do_delay_form),
+    "delay-force": (VALUE_FORM,
+                    lambda vals, env: do_delay_form(vals, env, True)),
+    "cons-stream": (VALUE_FORM, do_cons_stream_form),
+    "future": (VALUE_FORM, do_future_form),
+    "define-syntax": (VALUE_FORM, do_define_syntax_form),
+    "syntax-rules": (VALUE_FORM, do_syntax_rules_form),
+    "let": (FRAME_FORM, do_let_form),
+    "let-syntax": (FRAME_FORM, do_let_syntax_form),
+}
+SPECIAL_FORM_HANDLERS.update((name, (TAIL_FORM, fn))
+                             for name, fn in LOGIC_FORMS.items())
+
+# SPECIAL_FORM_HANDLERS indexed by symbol id, with None for other symbols
+SPECIAL_FORM_TABLE = [None] * (1 + max(Symbol(name).id
+                                       for name in SPECIAL_FORM_HANDLERS))
+for name, form in SPECIAL_FORM_HANDLERS.items():
+    SPECIAL_FORM_TABLE[Symbol(name).id] = form
+
+def special_form(first):
+    """The (kind, handler) pair of the special form named FIRST, or None if
+    FIRST does not name a special form."""
+    if type(first) is Symbol and first.id < len(SPECIAL_FORM_TABLE):
+        return SPECIAL_FORM_TABLE[first.id]
+    return None
+
 def scheme_optimized_eval(expr, env):
-    """Evaluate Scheme expression EXPR in environment ENV."""
+    """Evaluate Scheme expression EXPR in environment ENV.
+
+    A frame created for a tail call is reused by the next tail call if
+    nothing else refers to it."""
+    owned = None
     while True:
         if expr is None:
             raise SchemeError("Cannot evaluate an undefined expression.")
@@ -436,35 +1420,46 @@ def scheme_optimized_eval(expr, env):
         first, rest = expr.first, expr.second
 
         # Evaluate Combinations
-        if first in LOGIC_FORMS:
-            "*** YOUR CODE HERE ***"
-            expr = LOGIC_FORMS[first](rest, env)
-        elif first == "lambda":
-            return do_lambda_form(rest, env)
-        elif first == "mu":
-            return do_mu_form(rest)
-        elif first == "define":
-            return do_define_form(rest, env)
-        elif first == "quote":
-            return do_quote_form(rest)
-        elif first == "let":
+        if type(first) is Symbol and first.id < len(SPECIAL_FORM_TABLE):
+            form = SPECIAL_FORM_TABLE[first.id]
+        else:
+            form = None
+        if form is not None:
             "*** YOUR CODE HERE ***"
-            expr, env = do_let_form(rest, env)
+            kind, handler = form
+            if kind is VALUE_FORM:
+                return handler(rest, env)
+            elif kind is TAIL_FORM:
+                expr = handler(rest, env)
+            else:
+                expr, env = handler(rest, env)
+                owned = env
         else:
             "*** YOUR CODE HERE ***"
             procedure = scheme_optimized_eval(first, env)
-            args = rest.map(lambda operand: scheme_optimized_eval(operand, env))
+            if isinstance(procedure, Macro):
+                expr = expand_macro(procedure, expr)
+                continue
+            args = []
+            while rest is not nil:
+                args.append(scheme_optimized_eval(rest.first, env))
+                rest = rest.second
             if isinstance(procedure, PrimitiveProcedure):
-                return apply_primitive(procedure, args, env)
+                return complete_apply(procedure, args, env)
             elif isinstance(procedure, LambdaProcedure):
                 "*** YOUR CODE HERE ***"
-                new_frame = procedure.env
-                new_frame = new_frame.make_call_frame(procedure.formals, args)
-                expr, env = procedure.body, new_frame
+                bindings = bind_formals(procedure.names, args)
+                if env is owned and not owned.escaped:
+                    # Nothing refers to the frame of the finished body
+                    owned.parent, owned.bindings = procedure.env, bindings
+                else:
+                    owned = Frame(procedure.env, bindings)
+                owned.analysis = procedure.analysis
+                expr, env = procedure.body, owned
             elif isinstance(procedure, MuProcedure):
                 "*** YOUR CODE HERE ***"
-                new_frame = env.make_call_frame(procedure.formals, args)
-                expr, env = procedure.body, new_frame
+                owned = Frame(env, bind_formals(procedure.names, args))
+                expr, env = procedure.body, owned
             else:
                 # print(repr(procedure))
                 raise SchemeError("Cannot call {0}".format(str(procedure)))
@@ -473,34 +1468,325 @@ def scheme_optimized_eval(expr, env):
 ################################################################
 scheme_eval = scheme_optimized_eval
 
+# Higher-order primitives apply Scheme procedures through apply_values
+register_apply(apply_values)
+
+
+#######################
+# Parallel Evaluation #
+#######################
+
+# Procedures are applied in parallel by a pool of worker processes, each with
+# its own global frame.  A procedure is sent to a worker along with the global
+# bindings it depends on, rather than with the whole global frame; a global
+# frame received from another process stands for the receiver's own.
+
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+_home_frame = None   # The global frame of this process, for home_frame
+_in_worker = False   # Whether this process is a worker
+_executor = None     # The pool of workers, started when first used
+
+def home_frame():
+    """The global frame of this process, which a global frame received from
+    another process stands for."""
+    return _home_frame
+
+def _start_worker():
+    """Give a new worker process its own global frame."""
+    global _home_frame, _in_worker
+    _home_frame = create_global_frame()
+    _in_worker = True
+
+def parallel_executor():
+    """The pool of worker processes, which is started on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(PARALLEL_WORKERS,
+                                        initializer=_start_worker)
+    return _executor
+
+def shutdown_parallel():
+    """Stop the pool of worker processes, if it has been started.  A process
+    started by multiprocessing must do so before it exits, since it waits for
+    its workers to finish first."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+def _sendable(value):
+    """Whether VALUE can be pickled to send it to a worker."""
+    try:
+        pickle.dumps(value)
+    except (Exception, SchemeError):
+        return False
+    return True
+
+def global_dependencies(values, env):
+    """A dict of the bindings in the global frame of ENV that the procedures
+    among VALUES depend on: the global variables their bodies refer to, and
+    those of the procedures that those variables, or the variables they
+    capture, are bound to.  If a body may refer to variables it does not
+    name, all global bindings that can be sent to a worker are included.
+
+    >>> env = create_global_frame()
+    >>> for expr in ["(define n 2)", "(define (add x) (+ x n))",
+    ...              "(define (scale k) (lambda (x) (* k (add x))))"]:
+    ...     scheme_eval(read_line(expr), env)
+    >>> sorted(global_dependencies([scheme_eval(read_line("(scale 3)"), env)],
+    ...                            env))
+    ['*', '+', 'add', 'n']
+    """
+    global_env = env.global_frame()
+    bindings, seen = {}, set()
+    pending, sent_all = list(values), False
+    while pending:
+        value = pending.pop()
+        if not isinstance(value, (LambdaProcedure, MuProcedure)):
+            continue
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, LambdaProcedure):
+            analysis = value.analysis
+        else:
+            analysis = free_variables(formal_names(value.formals),
+                                      Pair(value.body, nil)) or False
+        if not analysis:
+            if not sent_all:
+                sent_all = True
+                for name, value in global_env.bindings.items():
+                    if name not in bindings and _sendable(value):
+                        bindings[name] = value
+                        pending.append(value)
+            continue
+        start = value.env if isinstance(value, LambdaProcedure) else global_env
+        for name in analysis.free:
+            frame = start
+            while frame.parent is not None and name not in frame.bindings:
+                frame = frame.parent
+            if name in frame.bindings:
+                if frame.parent is None:
+                    bindings[name] = frame.bindings[name]
+                pending.append(frame.bindings[name])
+    return bindings
+
+def _reduce_items(proc, items, env):
+    """Combine the non-empty Python list ITEMS from left to right by calling
+    PROC on each element and the combination so far, as reduce does."""
+    acc = items[0]
+    for item in items[1:]:
+        acc = complete_apply(proc, [item, acc], env)
+    return acc
+
+def _map_chunk(bindings, proc, items):
+    """The results of applying PROC to ITEMS in a worker, after defining
+    BINDINGS in its global frame."""
+    _home_frame.bindings.update(bindings)
+    try:
+        return [complete_apply(proc, [item], _home_frame) for item in items]
+    finally:
+        scheme_flush_output()
+
+def _reduce_chunk(bindings, proc, items):
+    """The combination of ITEMS by PROC in a worker, after defining BINDINGS
+    in its global frame."""
+    _home_frame.bindings.update(bindings)
+    try:
+        return _reduce_items(proc, items, _home_frame)
+    finally:
+        scheme_flush_output()
+
+def run_parallel(task, proc, items, chunk_size, env, name):
+    """The list of results of TASK(bindings, PROC, chunk), called by the
+    worker pool for consecutive chunks of the Python list ITEMS, where
+    bindings are the global dependencies of PROC in ENV.  CHUNK_SIZE is the
+    chunk size passed to NAME, or None to choose one.  In a worker, the chunks
+    are run serially."""
+    global _home_frame, _executor
+    if chunk_size is None:
+        chunk_size = -(-len(items) // (4 * PARALLEL_WORKERS)) or 1
+    elif not scheme_integerp(chunk_size) or chunk_size < 1:
+        raise SchemeError("bad chunk size ({0}) for {1}".format(chunk_size,
+                                                                name))
+    chunk_size = int(chunk_size)
+    chunks = [items[i:i + chunk_size]
+              for i in range(0, len(items), chunk_size)]
+    if _in_worker:
+        return [task({}, proc, chunk) for chunk in chunks]
+    _home_frame = env.global_frame()
+    bindings = global_dependencies([proc], env)
+    scheme_flush_output() # Or workers started by fork would repeat it
+    futures = [parallel_executor().submit(task, bindings, proc, chunk)
+               for chunk in chunks]
+    try:
+        return [pool_result(future, name) for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
+
+def pool_result(future, name):
+    """The result of FUTURE, submitted to the worker pool by NAME, which
+    raises a SchemeError if it could not be computed."""
+    global _executor
+    try:
+        return future.result()
+    except CancelledError:
+        raise SchemeError("{0}: cancelled".format(name))
+    except BrokenProcessPool:
+        _executor = None
+        raise SchemeError("{0}: a worker process stopped".format(name))
+    except (pickle.PicklingError, AttributeError, TypeError) as err:
+        raise SchemeError("{0}: cannot send value ({1})".format(name, err))
+
+@primitive("pmap", use_env=True)
+def scheme_pmap(proc, items, *rest):
+    """The list of results of applying PROC to each element of ITEMS, computed
+    by worker processes CHUNK-SIZE elements at a time: (pmap proc items
+    [chunk-size])."""
+    chunk_size, env = rest if len(rest) > 1 else (None, rest[-1])
+    check_type(items, scheme_listp, 1, 'pmap')
+    results = []
+    for chunk in run_parallel(_map_chunk, proc, scheme_values(items),
+                              chunk_size, env, 'pmap'):
+        results.extend(chunk)
+    return compact_list(results)
+
+class Future(object):
+    """The value of an expression that a worker process is evaluating, held
+    in a concurrent.futures future."""
+
+    def __init__(self, future):
+        self.future = future
+
+    def __str__(self):
+        return "#[future]"
+
+    def __reduce__(self):
+        # A PicklingError, unlike a SchemeError, is passed on to the pool
+        # future by the thread that sends work to the workers
+        raise pickle.PicklingError("a future cannot be sent to a worker; "
+                                   "touch it first")
+
+def _call_thunk(bindings, thunk):
+    """The value of calling THUNK in a worker, after defining BINDINGS in its
+    global frame."""
+    _home_frame.bindings.update(bindings)
+    try:
+        return complete_apply(thunk, [], _home_frame)
+    finally:
+        scheme_flush_output()
+
+def start_future(thunk, env):
+    """A Future for the value of calling THUNK, a procedure of no arguments
+    made in ENV, which is sent with its global dependencies to the worker
+    pool.  In a worker, THUNK is called at once."""
+    global _home_frame
+    if _in_worker:
+        future = PoolFuture()
+        try:
+            future.set_result(complete_apply(thunk, [], env))
+        except BaseException as err:  # As the pool does for other calls
+            future.set_exception(err)
+        return Future(future)
+    _home_frame = env.global_frame()
+    bindings = global_dependencies([thunk], env)
+    scheme_flush_output() # Or workers started by fork would repeat it
+    return Future(parallel_executor().submit(_call_thunk, bindings, thunk))
+
+@primitive("future?")
+def scheme_futurep(x):
+    return isinstance(x, Future)
+
+@primitive("touch")
+def scheme_touch(x):
+    """The value of the future X, waiting for it to be computed, or X itself
+    if it is not a future."""
+    if isinstance(x, Future):
+        return pool_result(x.future, 'touch')
+    return x
+
+@primitive("future-done?")
+def scheme_future_donep(f):
+    check_type(f, scheme_futurep, 0, 'future-done?')
+    return f.future.done()
+
+@primitive("future-cancel")
+def scheme_future_cancel(f):
+    """Cancel the future F if its evaluation has not started, and return
+    whether it was cancelled."""
+    check_type(f, scheme_futurep, 0, 'future-cancel')
+    return f.future.cancel()
+
+@primitive("preduce", use_env=True)
+def scheme_preduce(proc, init, items, *rest):
+    """Combine the elements of ITEMS like reduce, with each chunk of
+    CHUNK-SIZE elements combined by a worker process and the results of the
+    chunks combined in order, so PROC must be associative: (preduce proc init
+    items [chunk-size])."""
+    chunk_size, env = rest if len(rest) > 1 else (None, rest[-1])
+    check_type(items, scheme_listp, 2, 'preduce')
+    values = scheme_values(items)
+    if not values:
+        return init
+    partials = run_parallel(_reduce_chunk, proc, values, chunk_size, env,
+                            'preduce')
+    return _reduce_items(proc, partials, env)
+
 
 ################
 # Input/Output #
 ################
 
-def read_eval_print_loop(next_line, env):
-    """Read and evaluate input until an end of file or keyboard interrupt."""
-    while True:
-        try:
-            src = next_line()
-            while src.more_on_line:
-                expression = scheme_read(src)
-                result = scheme_eval(expression, env)
-                if result is not None:
-                    print(result)
-        except (SchemeError, SyntaxError, ValueError) as err:
-            print("Error:", err)
-        except (KeyboardInterrupt, EOFError):  # <Control>-D, etc.
-            return
+def read_eval_print_loop(next_line, env, optimized=False, timer=None):
+    """Read and evaluate input until an end of file or keyboard interrupt.
+    If OPTIMIZED, each expression is passed through optimize first.  Output
+    written by the program is flushed after each expression.  If TIMER is
+    given, it is called with the line of its source on which each expression
+    starts and the seconds taken to evaluate and print it."""
+    try:
+        while True:
+            try:
+                src = next_line()
+                while src.more_on_line:
+                    line = src.line_count
+                    expression = scheme_read(src)
+                    if optimized:
+                        expression = optimize(expression, env)
+                    start = time.perf_counter()
+                    try:
+                        result = scheme_eval(expression, env)
+                        if result is not None:
+                            scheme_print(result)
+                        scheme_flush_output()
+                    finally:
+                        if timer is not None:
+                            timer(line, time.perf_counter() - start)
+            except (SchemeError, SyntaxError, ValueError) as err:
+                scheme_flush_output()
+                print("Error:", err)
+            except (KeyboardInterrupt, EOFError):  # <Control>-D, etc.
+                return
+    finally:
+        scheme_flush_output()
 
 def scheme_load(sym, env):
-    """Load Scheme source file named SYM in environment ENV."""
-    check_type(sym, scheme_symbolp, 0, "load")
-    with scheme_open(sym) as infile:
+    """Load Scheme source file named SYM, a symbol or string, in environment
+    ENV."""
+    path = check_path(sym, 0, "load")
+    with scheme_open(path) as infile:
         lines = infile.readlines()
     def next_line():
         return buffer_lines(lines)
+    before = hash_consing_counts()
     read_eval_print_loop(next_line, env.global_frame())
+    after = hash_consing_counts()
+    if before is not None and after is not None:
+        read, kept = after[0] - before[0], after[1] - before[1]
+        shared = read / kept if kept else 1
+        print("; {0}: read {1} literal pairs, kept {2} ({3:.1f}x shared)"
+              .format(path, read, kept, shared), file=sys.stderr)
 
 def scheme_open(filename):
     """If either FILENAME or FILENAME.scm is the name of a valid file,
@@ -518,15 +1804,19 @@ def scheme_open(filename):
 def create_global_frame():
     """Initialize and return a single-frame environment with built-in names."""
     env = Frame(None)
-    env.define("eval", PrimitiveProcedure(scheme_eval, True))
-    env.define("apply", PrimitiveProcedure(scheme_apply, True))
-    env.define("load", PrimitiveProcedure(scheme_load, True))
+    env.define(Symbol("eval"), PrimitiveProcedure(scheme_eval, True))
+    env.define(Symbol("apply"), PrimitiveProcedure(scheme_apply, True))
+    env.define(Symbol("load"), PrimitiveProcedure(scheme_load, True))
+    env.define(Symbol("the-empty-stream"), nil)
     add_primitives(env)
     return env
 
 @main
 def run(*argv):
     next_line = buffer_input
+    optimized = bool(argv) and argv[0] == "-O"
+    if optimized:
+        argv = argv[1:]
     if argv:
         try:
             filename = argv[0]
@@ -537,4 +1827,4 @@ def run(*argv):
         except IOError as err:
             # print(err)
             sys.exit(1)
-    read_eval_print_loop(next_line, create_global_frame())
+    read_eval_print_loop(next_line, create_global_frame(), optimized)
@@ -1,15 +1,38 @@
 """This module implements the primitives of the Scheme language."""
 
+import atexit
+import csv
+import functools
+import io
+import json
 import math
+import mmap
 import operator
+import os
+import re
 import sys
-from scheme_reader import Pair, nil
+import tempfile
+import weakref
+from array import array
+from collections import OrderedDict
+from buffer import Buffer
+from scheme_reader import (Pair, nil, Symbol, String, Vector, NumericVector,
+                           HashTable, hash_key, print_datum, datum_text,
+                           mark_mutated, PRINT_LIMITS, scheme_read,
+                           SharedPair, set_hash_consing, hash_consing_counts,
+                           literal_datum, CompactList, compact_list)
+from scheme_tokens import next_candidate_token, make_token
 
 try:
     import turtle
 except:
     print("warning: could not import the turtle module.", file=sys.stderr)
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class SchemeError(BaseException):
     """Exception indicating an error in a Scheme program."""
 
@@ -18,28 +41,76 @@ class SchemeError(BaseException):
 ########################
 
 class PrimitiveProcedure:
-    """A Scheme procedure defined as a Python function."""
+    """A Scheme procedure defined as a Python function.  One registered by
+    primitive has the NAME it was registered under."""
 
-    def __init__(self, fn, use_env=False):
+    def __init__(self, fn, use_env=False, name=None):
         self.fn = fn
         self.use_env = use_env
+        self.name = name
+
+    def __reduce_ex__(self, protocol):
+        # Several primitive functions share a Python name, so a registered
+        # primitive is sent to another process by its Scheme name instead
+        if self.name is not None:
+            return (registered_primitive, (self.name,))
+        return object.__reduce_ex__(self, protocol)
 
 _PRIMITIVES = []
+_PRIMITIVES_BY_NAME = {}
 
-def primitive(*names):
-    """An annotation to convert a Python function into a PrimitiveProcedure."""
+def primitive(*names, use_env=False):
+    """An annotation to convert a Python function into a PrimitiveProcedure.
+    If USE_ENV, the function receives the calling environment as an extra
+    last argument."""
     def add(fn):
-        proc = PrimitiveProcedure(fn)
+        proc = PrimitiveProcedure(fn, use_env, names[0])
+        _PRIMITIVES_BY_NAME[names[0]] = proc
         for name in names:
-            _PRIMITIVES.append((name,proc))
+            _PRIMITIVES.append((Symbol(name), proc))
         return fn
     return add
 
+def registered_primitive(name):
+    """The PrimitiveProcedure that primitive registered under NAME.
+
+    >>> import pickle
+    >>> even, odd = [proc for name, proc in _PRIMITIVES
+    ...              if name in ("even?", "odd?")]
+    >>> pickle.loads(pickle.dumps(odd)) is odd, even.fn is odd.fn
+    (True, False)
+    """
+    return _PRIMITIVES_BY_NAME[name]
+
 def add_primitives(frame):
     """Enter bindings in _PRIMITIVES into FRAME, an environment frame."""
     for name, proc in _PRIMITIVES:
         frame.define(name, proc)
 
+# Primitives that call back into Scheme procedures do so through
+# complete_apply.  Non-primitive procedures are applied by the evaluator in
+# scheme.py, which imports this module and so registers its apply function
+# here with register_apply.
+_scheme_apply = None
+
+def register_apply(fn):
+    """Use FN(procedure, args, env) to apply non-primitive procedures to
+    a Python list of arguments."""
+    global _scheme_apply
+    _scheme_apply = fn
+
+def complete_apply(procedure, args, env):
+    """Apply Scheme PROCEDURE to the Python list ARGS in environment ENV and
+    return the result, without building a Scheme list of the arguments."""
+    if isinstance(procedure, PrimitiveProcedure):
+        if procedure.use_env:
+            args = args + [env]
+        try:
+            return procedure.fn(*args)
+        except TypeError:
+            raise SchemeError()
+    return _scheme_apply(procedure, args, env)
+
 def check_type(val, predicate, k, name):
     """Returns VAL.  Raises a SchemeError if not PREDICATE(VAL)
     using "argument K of NAME" to describe the offending value."""
@@ -64,21 +135,29 @@ def scheme_false(val):
 def scheme_not(x):
     return not scheme_true(x)
 
-@primitive("eq?")
+@primitive("eq?", "eqv?")
 def scheme_eqp(x, y):
-    return x == y
+    if scheme_numberp(x) and scheme_numberp(y):
+        return x == y
+    return x is y
+
+@primitive("equal?")
+def scheme_equalp(x, y):
+    return hash_key(x, True) == hash_key(y, True)
 
 @primitive("pair?")
 def scheme_pairp(x):
     return isinstance(x, Pair)
 
-@primitive("null?")
+@primitive("null?", "stream-null?")
 def scheme_nullp(x):
     return x is nil
 
 @primitive("list?")
 def scheme_listp(x):
     """Return whether x is a well-formed list. Assumes no cycles."""
+    if isinstance(x, CompactList) and x.compact():
+        return True
     while x is not nil:
         if not isinstance(x, Pair):
             return False
@@ -106,12 +185,29 @@ def scheme_cdr(x):
     check_type(x, scheme_pairp, 0, 'cdr')
     return x.second
 
+def _check_unshared(x, name):
+    """Check that the pair X, argument 0 of NAME, may be mutated."""
+    if isinstance(x, SharedPair):
+        raise SchemeError("{0}: cannot mutate shared literal {1}".format(
+            name, datum_text(x)))
+
+@primitive("set-car!")
+def scheme_set_car(x, y):
+    check_type(x, scheme_pairp, 0, 'set-car!')
+    _check_unshared(x, 'set-car!')
+    mark_mutated()
+    x.first = y
+
+@primitive("set-cdr!")
+def scheme_set_cdr(x, y):
+    check_type(x, scheme_pairp, 0, 'set-cdr!')
+    _check_unshared(x, 'set-cdr!')
+    mark_mutated()
+    x.second = y
+
 @primitive("list")
 def scheme_list(*vals):
-    result = nil
-    for i in range(len(vals)-1, -1, -1):
-        result = Pair(vals[i], result)
-    return result
+    return compact_list(list(vals))
 
 @primitive("append")
 def scheme_append(*vals):
@@ -131,9 +227,163 @@ def scheme_append(*vals):
             result = r
     return result
 
+##
+## List library
+##
+
+def _list_items(x, k, name):
+    """Return the elements of the Scheme list X, argument K of NAME, as a
+    Python list."""
+    if isinstance(x, CompactList):
+        items = x.elements()
+        if items is not None:
+            return items
+    items = []
+    y = x
+    while isinstance(y, Pair):
+        items.append(y.first)
+        y = y.second
+    if y is not nil:
+        raise SchemeError("argument {0} of {1} is not a list".format(k, name))
+    return items
+
+@primitive("map", use_env=True)
+def scheme_map(proc, *lists):
+    """The list of results of applying PROC to the first elements of LISTS,
+    then to their second elements, and so on to the end of the shortest."""
+    env = lists[-1]
+    columns = [_list_items(x, i + 1, 'map') for i, x in enumerate(lists[:-1])]
+    return scheme_list(*[complete_apply(proc, list(args), env)
+                         for args in zip(*columns)])
+
+@primitive("for-each", use_env=True)
+def scheme_for_each(proc, *lists):
+    env = lists[-1]
+    columns = [_list_items(x, i + 1, 'for-each')
+               for i, x in enumerate(lists[:-1])]
+    for args in zip(*columns):
+        complete_apply(proc, list(args), env)
+
+@primitive("filter", use_env=True)
+def scheme_filter(pred, x, env):
+    return scheme_list(*[y for y in _list_items(x, 1, 'filter')
+                         if scheme_true(complete_apply(pred, [y], env))])
+
+@primitive("remove", use_env=True)
+def scheme_remove(pred, x, env):
+    return scheme_list(*[y for y in _list_items(x, 1, 'remove')
+                         if scheme_false(complete_apply(pred, [y], env))])
+
+@primitive("fold", use_env=True)
+def scheme_fold(proc, init, x, env):
+    """Combine the elements of X from left to right: (PROC elem acc)."""
+    for y in _list_items(x, 2, 'fold'):
+        init = complete_apply(proc, [y, init], env)
+    return init
+
+@primitive("fold-right", "accumulate", use_env=True)
+def scheme_fold_right(proc, init, x, env):
+    """Combine the elements of X from right to left: (PROC elem acc)."""
+    for y in reversed(_list_items(x, 2, 'fold-right')):
+        init = complete_apply(proc, [y, init], env)
+    return init
+
+@primitive("reduce", use_env=True)
+def scheme_reduce(proc, init, x, env):
+    """Combine the elements of X like fold, starting from its first element
+    rather than INIT, which is returned only if X is empty."""
+    items = _list_items(x, 2, 'reduce')
+    if not items:
+        return init
+    acc = items[0]
+    for y in items[1:]:
+        acc = complete_apply(proc, [y, acc], env)
+    return acc
+
+def _member(x, s, same, name):
+    """The first tail of list S whose first element is SAME as X, or False."""
+    while isinstance(s, Pair):
+        if same(x, s.first):
+            return s
+        s = s.second
+    if s is not nil:
+        raise SchemeError("argument 1 of {0} is not a list".format(name))
+    return False
+
+@primitive("member")
+def scheme_member(x, s):
+    return _member(x, s, scheme_equalp, 'member')
+
+@primitive("memq", "memv")
+def scheme_memq(x, s):
+    return _member(x, s, scheme_eqp, 'memq')
+
+def _assoc(key, alist, same, name):
+    """The first pair in the association list ALIST whose first element is
+    SAME as KEY, or False."""
+    while isinstance(alist, Pair):
+        entry = alist.first
+        check_type(entry, scheme_pairp, 1, name)
+        if same(key, entry.first):
+            return entry
+        alist = alist.second
+    if alist is not nil:
+        raise SchemeError("argument 1 of {0} is not a list".format(name))
+    return False
+
+@primitive("assoc")
+def scheme_assoc(key, alist):
+    return _assoc(key, alist, scheme_equalp, 'assoc')
+
+@primitive("assq", "assv")
+def scheme_assq(key, alist):
+    return _assoc(key, alist, scheme_eqp, 'assq')
+
+@primitive("reverse")
+def scheme_reverse(x):
+    result = nil
+    for y in _list_items(x, 0, 'reverse'):
+        result = Pair(y, result)
+    return result
+
+@primitive("list-tail")
+def scheme_list_tail(x, k):
+    k = _check_count(k, 'list-tail')
+    if isinstance(x, CompactList) and x.tail(k) is not None:
+        return x.tail(k)
+    for _ in range(k):
+        check_type(x, scheme_pairp, 0, 'list-tail')
+        x = x.second
+    return x
+
+@primitive("list-ref")
+def scheme_list_ref(x, k):
+    x = scheme_list_tail(x, k)
+    check_type(x, scheme_pairp, 0, 'list-ref')
+    return x.first
+
+@primitive("last-pair")
+def scheme_last_pair(x):
+    check_type(x, scheme_pairp, 0, 'last-pair')
+    while isinstance(x.second, Pair):
+        x = x.second
+    return x
+
+@primitive("delete")
+def scheme_delete(x, s):
+    return scheme_list(*[y for y in _list_items(s, 1, 'delete')
+                         if not scheme_equalp(x, y)])
+
+@primitive("iota")
+def scheme_iota(count, start=0, step=1):
+    count = _check_count(count, 'iota')
+    _check_nums(start, step)
+    return scheme_list(*[_scheme_number(start + i * step)
+                         for i in range(count)])
+
 @primitive("symbol?")
 def scheme_symbolp(x):
-    return isinstance(x, str)
+    return isinstance(x, Symbol)
 
 @primitive("number?")
 def scheme_numberp(x):
@@ -150,6 +400,12 @@ def _check_nums(*vals):
             msg = "operand {0} ({1}) is not a number"
             raise SchemeError(msg.format(i, v))
 
+def _scheme_number(s):
+    """Return the number S as a Scheme value, an int if S is integral."""
+    if round(s) == s:
+        s = round(s)
+    return s
+
 def _arith(fn, init, vals):
     """Perform the fn fneration on the number values of VALS, with INIT as
     the value when VALS is empty. Returns the result as a Scheme value."""
@@ -157,9 +413,7 @@ def _arith(fn, init, vals):
     s = init
     for val in vals:
         s = fn(s, val)
-    if round(s) == s:
-        s = round(s)
-    return s
+    return _scheme_number(s)
 
 @primitive("+")
 def scheme_add(*vals):
@@ -245,6 +499,1232 @@ def scheme_evenp(x):
     _check_nums(x)
     return x == 0
 
+##
+## Vectors
+##
+
+def _check_index(k, n, name):
+    """Return K as an int.  Raises a SchemeError if K is not a valid index
+    into a sequence of length N passed to NAME."""
+    if not (scheme_numberp(k) and scheme_integerp(k)):
+        raise SchemeError("index ({0}) of {1} is not an integer".format(
+            k, name))
+    if not 0 <= k < n:
+        raise SchemeError("index {0} out of range in {1}".format(k, name))
+    return int(k)
+
+def _check_count(k, name):
+    """Return K as an int.  Raises a SchemeError if K, passed to NAME as a
+    count or length, is not a non-negative integer."""
+    _check_nums(k)
+    if k < 0 or not scheme_integerp(k):
+        raise SchemeError("bad count ({0}) for {1}".format(k, name))
+    return int(k)
+
+@primitive("vector?")
+def scheme_vectorp(x):
+    return isinstance(x, Vector)
+
+@primitive("make-vector")
+def scheme_make_vector(k, fill=False):
+    return Vector([fill] * _check_count(k, 'make-vector'))
+
+@primitive("vector")
+def scheme_vector(*vals):
+    return Vector(list(vals))
+
+@primitive("vector-length")
+def scheme_vector_length(v):
+    check_type(v, scheme_vectorp, 0, 'vector-length')
+    return len(v.items)
+
+@primitive("vector-ref")
+def scheme_vector_ref(v, k):
+    check_type(v, scheme_vectorp, 0, 'vector-ref')
+    return v.items[_check_index(k, len(v.items), 'vector-ref')]
+
+@primitive("vector-set!")
+def scheme_vector_set(v, k, val):
+    check_type(v, scheme_vectorp, 0, 'vector-set!')
+    mark_mutated()
+    v.items[_check_index(k, len(v.items), 'vector-set!')] = val
+
+@primitive("vector-fill!")
+def scheme_vector_fill(v, fill):
+    check_type(v, scheme_vectorp, 0, 'vector-fill!')
+    mark_mutated()
+    v.items[:] = [fill] * len(v.items)
+
+@primitive("vector->list")
+def scheme_vector_to_list(v):
+    check_type(v, scheme_vectorp, 0, 'vector->list')
+    return scheme_list(*v.items)
+
+@primitive("list->vector")
+def scheme_list_to_vector(x):
+    check_type(x, scheme_listp, 0, 'list->vector')
+    items = []
+    while x is not nil:
+        items.append(x.first)
+        x = x.second
+    return Vector(items)
+
+##
+## Homogeneous numeric vectors
+##
+
+# Primitives that numeric vector maps apply element-wise in one batched
+# operation, rather than by calling back into Scheme for each element.
+_BATCHED_OPS = {
+    scheme_add: operator.add,
+    scheme_sub: operator.sub,
+    scheme_mul: operator.mul,
+    scheme_div: operator.truediv,
+}
+
+def _batched_op(proc, nargs):
+    """The element-wise Python operator equivalent to applying the Scheme
+    procedure PROC to NARGS numeric vectors, or None if there is none."""
+    if not isinstance(proc, PrimitiveProcedure):
+        return None
+    if proc.fn is scheme_sub and nargs == 1:
+        return operator.neg
+    if nargs < 2:
+        return None
+    return _BATCHED_OPS.get(proc.fn)
+
+def _numeric_vector_primitives(tag, typecode):
+    """Define the primitives for the numeric vector type TAG (e.g., f64),
+    whose elements are stored in arrays of the array module TYPECODE."""
+    kind = tag + 'vector'
+    integral = typecode != 'd'
+    bits = 8 * array(typecode).itemsize
+    low, high = -(1 << bits - 1), (1 << bits - 1) - 1
+
+    def vectorp(x):
+        return isinstance(x, NumericVector) and x.tag == tag
+
+    def element(x, k, name, role='argument'):
+        """X as an element, where X is ROLE K of NAME."""
+        if scheme_numberp(x) and not (integral and isinstance(x, float) and
+                                      not x.is_integer()):
+            try:
+                value = int(x) if integral else float(x)
+                if not integral or low <= value <= high:
+                    return value
+            except OverflowError:
+                pass
+            msg = "{0} {1} of {2} is out of range for {3}"
+            raise SchemeError(msg.format(role, k, name, kind))
+        msg = "{0} {1} of {2} has wrong type ({3})"
+        raise SchemeError(msg.format(role, k, name, type(x).__name__))
+
+    def pack(values, name):
+        """A vector of the Python list VALUES, computed by NAME."""
+        try:
+            return NumericVector(tag, array(typecode, values))
+        except (TypeError, OverflowError):
+            values = [element(x, i, name, 'result')
+                      for i, x in enumerate(values)]
+            return NumericVector(tag, array(typecode, values))
+
+    def from_numpy(result, name):
+        if integral and result.dtype.kind == 'f':
+            whole = numpy.isfinite(result) & (result == numpy.round(result))
+            if not whole.all():
+                msg = "result {0} of {1} has wrong type (float)"
+                raise SchemeError(msg.format(int(numpy.argmin(whole)), name))
+        data = result.astype(typecode).tobytes()
+        return NumericVector(tag, array(typecode, data))
+
+    def as_numpy(v):
+        return numpy.frombuffer(v.data, dtype=typecode)
+
+    primitive(kind + '?')(vectorp)
+
+    @primitive('make-' + kind)
+    def make_vector(k, fill=0):
+        name = 'make-' + kind
+        return pack([element(fill, 1, name)] * _check_count(k, name), name)
+
+    @primitive(kind)
+    def vector(*vals):
+        return pack([element(x, i, kind) for i, x in enumerate(vals)], kind)
+
+    @primitive(kind + '-length')
+    def vector_length(v):
+        check_type(v, vectorp, 0, kind + '-length')
+        return len(v.data)
+
+    @primitive(kind + '-ref')
+    def vector_ref(v, k):
+        name = kind + '-ref'
+        check_type(v, vectorp, 0, name)
+        return v.data[_check_index(k, len(v.data), name)]
+
+    @primitive(kind + '-set!')
+    def vector_set(v, k, val):
+        name = kind + '-set!'
+        check_type(v, vectorp, 0, name)
+        k = _check_index(k, len(v.data), name)
+        val = element(val, 2, name)
+        try:
+            v.data[k] = val
+        except TypeError as err:
+            raise SchemeError("{0}: {1}".format(name, err))
+
+    @primitive(kind + '->list')
+    def vector_to_list(v):
+        check_type(v, vectorp, 0, kind + '->list')
+        return scheme_list(*v.data)
+
+    @primitive('list->' + kind)
+    def list_to_vector(x):
+        name = 'list->' + kind
+        check_type(x, scheme_listp, 0, name)
+        values = []
+        while x is not nil:
+            values.append(element(x.first, 0, name))
+            x = x.second
+        return pack(values, name)
+
+    @primitive(kind + '-map', use_env=True)
+    def vector_map(proc, v, *rest):
+        """Apply PROC element-wise to V and the vectors in REST, which must
+        have the same length.  Arithmetic primitives are applied as a single
+        batched operation over whole vectors."""
+        name = kind + '-map'
+        env = rest[-1]
+        vectors = (v,) + rest[:-1]
+        for i, u in enumerate(vectors):
+            check_type(u, vectorp, i + 1, name)
+            if len(u.data) != len(v.data):
+                raise SchemeError("{0}: vectors differ in length".format(name))
+        op = _batched_op(proc, len(vectors))
+        try:
+            if op is None:
+                values = [complete_apply(proc, list(xs), env)
+                          for xs in zip(*(u.data for u in vectors))]
+                return pack([element(x, i, name, 'result')
+                             for i, x in enumerate(values)], name)
+            if op is operator.neg:
+                if numpy is not None:
+                    return from_numpy(-as_numpy(v), name)
+                return pack(list(map(op, v.data)), name)
+            if numpy is not None:
+                with numpy.errstate(divide='raise', invalid='raise'):
+                    result = as_numpy(v)
+                    for u in vectors[1:]:
+                        result = op(result, as_numpy(u))
+                return from_numpy(result, name)
+            result = v.data
+            for u in vectors[1:]:
+                result = list(map(op, result, u.data))
+            return pack(result, name)
+        except (ZeroDivisionError, FloatingPointError) as err:
+            raise SchemeError("{0}: {1}".format(name, err))
+
+    @primitive(kind + '-slice')
+    def vector_slice(v, start, end=None):
+        """A view of the elements of V from START up to END, sharing them
+        rather than copying."""
+        name = kind + '-slice'
+        check_type(v, vectorp, 0, name)
+        if end is None:
+            end = len(v.data)
+        end = _check_index(end, len(v.data) + 1, name)
+        start = _check_index(start, end + 1, name)
+        return NumericVector(tag, memoryview(v.data)[start:end])
+
+    @primitive('mmap-' + kind)
+    def mmap_vector(path, offset=0, count=None):
+        """A read-only vector of the elements stored in the binary file PATH,
+        starting OFFSET bytes into it.  The file is memory-mapped rather than
+        read, so elements are loaded only when used.  If COUNT is None, all
+        whole elements up to the end of the file are included."""
+        name = 'mmap-' + kind
+        path = check_path(path, 0, name)
+        _check_nums(offset)
+        try:
+            with open(path, 'rb') as f:
+                data = memoryview(mmap.mmap(f.fileno(), 0,
+                                            access=mmap.ACCESS_READ))
+        except (OSError, ValueError) as err:
+            raise SchemeError(str(err))
+        offset = _check_index(offset, len(data) + 1, name)
+        size = array(typecode).itemsize
+        if count is None:
+            count = (len(data) - offset) // size
+        _check_nums(count)
+        if count < 0 or offset + count * size > len(data):
+            raise SchemeError("{0}: {1} elements extend past the end of {2}"
+                              .format(name, count, path))
+        end = offset + int(count) * size
+        return NumericVector(tag, data[offset:end].cast(typecode))
+
+    @primitive(kind + '-sum')
+    def vector_sum(v):
+        check_type(v, vectorp, 0, kind + '-sum')
+        if numpy is not None:
+            return _scheme_number(as_numpy(v).sum().item())
+        return _scheme_number(sum(v.data) if integral else math.fsum(v.data))
+
+    @primitive(kind + '-dot')
+    def vector_dot(u, v):
+        name = kind + '-dot'
+        check_type(u, vectorp, 0, name)
+        check_type(v, vectorp, 1, name)
+        if len(u.data) != len(v.data):
+            raise SchemeError("{0}: vectors differ in length".format(name))
+        if numpy is not None:
+            return _scheme_number(numpy.dot(as_numpy(u), as_numpy(v)).item())
+        products = map(operator.mul, u.data, v.data)
+        if integral:
+            return _scheme_number(sum(products))
+        return _scheme_number(math.fsum(products))
+
+    @primitive(kind + '-scale')
+    def vector_scale(v, k):
+        name = kind + '-scale'
+        check_type(v, vectorp, 0, name)
+        k = element(k, 1, name)
+        if numpy is not None:
+            return from_numpy(as_numpy(v) * k, name)
+        return pack([x * k for x in v.data], name)
+
+_numeric_vector_primitives('f64', 'd')
+_numeric_vector_primitives('s64', 'q')
+_numeric_vector_primitives('s32', 'i')
+
+##
+## Hash tables
+##
+
+@primitive("hash-table?")
+def scheme_hash_tablep(x):
+    return isinstance(x, HashTable)
+
+@primitive("make-hash-table")
+def scheme_make_hash_table(equiv=None):
+    """A new hash table whose keys are compared with the primitive EQUIV,
+    which is equal? (the default) or eq?."""
+    if equiv is None or (isinstance(equiv, PrimitiveProcedure) and
+                         equiv.fn is scheme_equalp):
+        return HashTable(True)
+    if isinstance(equiv, PrimitiveProcedure) and equiv.fn is scheme_eqp:
+        return HashTable(False)
+    raise SchemeError("make-hash-table: unsupported equivalence {0}".format(
+        equiv))
+
+@primitive("hash-table-ref", use_env=True)
+def scheme_hash_table_ref(table, *rest):
+    """The value for a key in TABLE.  REST is the key, an optional thunk and
+    the environment.  If there is no value, the result of calling the
+    thunk, or an error if it is not given."""
+    *args, env = rest
+    if not 1 <= len(args) <= 2:
+        raise SchemeError("hash-table-ref: wrong number of arguments")
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-ref')
+    key = args[0]
+    entry = table.entries.get(table.key(key))
+    if entry is not None:
+        return entry[1]
+    if len(args) > 1:
+        return complete_apply(args[1], [], env)
+    raise SchemeError("hash-table-ref: no value for key {0}".format(key))
+
+@primitive("hash-table-ref/default")
+def scheme_hash_table_ref_default(table, key, default):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-ref/default')
+    entry = table.entries.get(table.key(key))
+    return default if entry is None else entry[1]
+
+@primitive("hash-table-set!")
+def scheme_hash_table_set(table, key, val):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-set!')
+    table.entries[table.key(key)] = (key, val)
+
+@primitive("hash-table-delete!")
+def scheme_hash_table_delete(table, key):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-delete!')
+    table.entries.pop(table.key(key), None)
+
+@primitive("hash-table-contains?", "hash-table-exists?")
+def scheme_hash_table_containsp(table, key):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-contains?')
+    return table.key(key) in table.entries
+
+@primitive("hash-table-count", "hash-table-size")
+def scheme_hash_table_count(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-count')
+    return len(table.entries)
+
+@primitive("hash-table-keys")
+def scheme_hash_table_keys(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-keys')
+    return scheme_list(*(key for key, _ in table.entries.values()))
+
+@primitive("hash-table-values")
+def scheme_hash_table_values(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-values')
+    return scheme_list(*(val for _, val in table.entries.values()))
+
+@primitive("hash-table->alist")
+def scheme_hash_table_to_alist(table):
+    check_type(table, scheme_hash_tablep, 0, 'hash-table->alist')
+    return scheme_list(*(Pair(key, val)
+                         for key, val in table.entries.values()))
+
+@primitive("hash-table-walk", use_env=True)
+def scheme_hash_table_walk(table, proc, env):
+    """Call PROC on the key and value of each entry in TABLE."""
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-walk')
+    for key, val in list(table.entries.values()):
+        complete_apply(proc, [key, val], env)
+
+@primitive("hash-table-update!/default", use_env=True)
+def scheme_hash_table_update_default(table, key, proc, default, env):
+    """Set the value for KEY in TABLE to the result of calling PROC on its
+    current value, or on DEFAULT if it has none."""
+    check_type(table, scheme_hash_tablep, 0, 'hash-table-update!/default')
+    k = table.key(key)
+    entry = table.entries.get(k)
+    val = default if entry is None else entry[1]
+    table.entries[k] = (key, complete_apply(proc, [val], env))
+
+##
+## Sorting
+##
+
+def _sorted(items, less, env):
+    """A stably sorted copy of the Python list ITEMS, ordered by the Scheme
+    procedure LESS.  When LESS is the < or > primitive, numbers are compared
+    directly without calling back into Scheme."""
+    if (isinstance(less, PrimitiveProcedure) and
+            less.fn in (scheme_lt, scheme_gt)):
+        _check_nums(*items)
+        return sorted(items, reverse=less.fn is scheme_gt)
+    # Python's sort only asks whether one key is less than another, so a
+    # single call to LESS decides each comparison.
+    def compare(x, y):
+        return -1 if scheme_true(complete_apply(less, [x, y], env)) else 0
+    return sorted(items, key=functools.cmp_to_key(compare))
+
+@primitive("sort", use_env=True)
+def scheme_sort(seq, less, env):
+    """A sorted copy of SEQ, a list or vector, ordered by LESS."""
+    if scheme_vectorp(seq):
+        return Vector(_sorted(seq.items, less, env))
+    return scheme_list(*_sorted(_list_items(seq, 0, 'sort'), less, env))
+
+@primitive("sort!", use_env=True)
+def scheme_sort_in_place(v, less, env):
+    """Sort the vector V by LESS in place."""
+    check_type(v, scheme_vectorp, 0, 'sort!')
+    v.items[:] = _sorted(v.items, less, env)
+
+@primitive("list-sort", use_env=True)
+def scheme_list_sort(less, x, env):
+    return scheme_list(*_sorted(_list_items(x, 1, 'list-sort'), less, env))
+
+##
+## Memoization
+##
+
+class MemoizedProcedure(PrimitiveProcedure):
+    """A procedure that calls the Scheme procedure PROC and caches its results
+    by argument values, comparing lists structurally as equal? does.  At most
+    MAX_ENTRIES results are kept (or all, if it is None), evicting the least
+    recently used first."""
+
+    def __init__(self, proc, max_entries=None):
+        PrimitiveProcedure.__init__(self, self.call, True)
+        self.proc = proc
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, *args):
+        env, args = args[-1], list(args[:-1])
+        key = tuple(hash_key(arg, True) for arg in args)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        result = complete_apply(self.proc, args, env)
+        self.cache[key] = result
+        if self.max_entries is not None and len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return result
+
+    def __str__(self):
+        return "(memoize {0})".format(str(self.proc))
+
+def scheme_memoizedp(x):
+    return isinstance(x, MemoizedProcedure)
+
+@primitive("memoize")
+def scheme_memoize(proc, max_entries=None):
+    if max_entries is not None:
+        _check_nums(max_entries)
+        if max_entries < 1 or not scheme_integerp(max_entries):
+            raise SchemeError("bad cache size for memoize: {0}".format(
+                max_entries))
+        max_entries = int(max_entries)
+    return MemoizedProcedure(proc, max_entries)
+
+@primitive("memo-stats")
+def scheme_memo_stats(proc):
+    """An association list of the cache hits, misses and entries of PROC."""
+    check_type(proc, scheme_memoizedp, 0, 'memo-stats')
+    return scheme_list(Pair(Symbol('hits'), proc.hits),
+                       Pair(Symbol('misses'), proc.misses),
+                       Pair(Symbol('entries'), len(proc.cache)))
+
+@primitive("memo-clear!")
+def scheme_memo_clear(proc):
+    check_type(proc, scheme_memoizedp, 0, 'memo-clear!')
+    proc.cache.clear()
+    proc.hits = proc.misses = 0
+
+##
+## Promises and streams
+##
+
+class Promise(object):
+    """A promise to compute a value by calling THUNK, a Python function of no
+    arguments, at most once.  A CHAINED promise (made by delay-force) expects
+    THUNK to return another promise, whose value becomes its own."""
+
+    def __init__(self, thunk, chained=False):
+        self.thunk = thunk
+        self.chained = chained
+        self.forced = False
+        self.value = None
+
+    def __str__(self):
+        return "#[promise]"
+
+def scheme_force(p):
+    """The value of promise P, computed on first use and remembered.  A chain
+    of promises made by delay-force is followed iteratively, so forcing a long
+    chain does not grow the Python stack."""
+    while not p.forced:
+        value = p.thunk()
+        if p.forced:  # The thunk forced P itself
+            break
+        if p.chained and isinstance(value, Promise):
+            if value.forced:
+                p.value, p.forced = value.value, True
+            else:
+                p.thunk, p.chained = value.thunk, value.chained
+        else:
+            p.value, p.forced = value, True
+    p.thunk = None  # Release whatever the computation referenced
+    return p.value
+
+@primitive("promise?")
+def scheme_promisep(x):
+    return isinstance(x, Promise)
+
+@primitive("force")
+def scheme_force_primitive(x):
+    return scheme_force(x) if scheme_promisep(x) else x
+
+@primitive("make-promise")
+def scheme_make_promise(x):
+    if scheme_promisep(x):
+        return x
+    p = Promise(None)
+    p.value, p.forced = x, True
+    return p
+
+@primitive("stream-pair?")
+def scheme_stream_pairp(x):
+    return scheme_pairp(x) and scheme_promisep(x.second)
+
+@primitive("stream-car")
+def scheme_stream_car(s):
+    check_type(s, scheme_stream_pairp, 0, 'stream-car')
+    return s.first
+
+@primitive("stream-cdr")
+def scheme_stream_cdr(s):
+    check_type(s, scheme_stream_pairp, 0, 'stream-cdr')
+    return scheme_force(s.second)
+
+@primitive("stream-ref")
+def scheme_stream_ref(s, k):
+    for _ in range(_check_count(k, 'stream-ref')):
+        s = scheme_stream_cdr(s)
+    return scheme_stream_car(s)
+
+@primitive("stream-take")
+def scheme_stream_take(s, k):
+    """A stream of the first K elements of stream S (or all, if fewer)."""
+    _check_nums(k)
+    if k <= 0 or s is nil:
+        return nil
+    check_type(s, scheme_stream_pairp, 0, 'stream-take')
+    return Pair(s.first, Promise(
+        lambda: scheme_stream_take(scheme_force(s.second), k - 1)))
+
+@primitive("stream->list")
+def scheme_stream_to_list(s, k=None):
+    """A list of the first K elements of stream S, or all of them."""
+    items = []
+    while s is not nil and (k is None or len(items) < k):
+        items.append(scheme_stream_car(s))
+        s = scheme_stream_cdr(s)
+    return scheme_list(*items)
+
+@primitive("stream-map", use_env=True)
+def scheme_stream_map(proc, *streams):
+    """The stream of results of applying PROC to the elements of STREAMS,
+    ending with the shortest."""
+    env, streams = streams[-1], streams[:-1]
+    if any(s is nil for s in streams):
+        return nil
+    for i, s in enumerate(streams):
+        check_type(s, scheme_stream_pairp, i + 1, 'stream-map')
+    first = complete_apply(proc, [s.first for s in streams], env)
+    def rest():
+        tails = [scheme_force(s.second) for s in streams]
+        return scheme_stream_map(proc, *(tails + [env]))
+    return Pair(first, Promise(rest))
+
+@primitive("stream-filter", use_env=True)
+def scheme_stream_filter(pred, s, env):
+    """The stream of elements of stream S that satisfy PRED.  Elements that
+    do not are skipped in a loop, however many there are in a row."""
+    while s is not nil:
+        check_type(s, scheme_stream_pairp, 1, 'stream-filter')
+        if scheme_true(complete_apply(pred, [s.first], env)):
+            tail = s.second
+            return Pair(s.first, Promise(
+                lambda: scheme_stream_filter(pred, scheme_force(tail), env)))
+        s = scheme_force(s.second)
+    return nil
+
+##
+## Strings
+##
+
+@primitive("string?")
+def scheme_stringp(x):
+    return isinstance(x, String)
+
+def _text(s, k, name):
+    """The text of S, argument K of NAME, which must be a string."""
+    return check_type(s, scheme_stringp, k, name).text
+
+def _display_text(val):
+    """The text that display writes for VAL."""
+    return datum_text(val, True)
+
+@primitive("string-length")
+def scheme_string_length(s):
+    return len(_text(s, 0, 'string-length'))
+
+@primitive("string-ref")
+def scheme_string_ref(s, k):
+    text = _text(s, 0, 'string-ref')
+    return String(text[_check_index(k, len(text), 'string-ref')])
+
+@primitive("substring")
+def scheme_substring(s, start, end=None):
+    text = _text(s, 0, 'substring')
+    start = _check_count(start, 'substring')
+    end = len(text) if end is None else _check_count(end, 'substring')
+    if not start <= end <= len(text):
+        raise SchemeError("bad range [{0}, {1}) for substring".format(
+            start, end))
+    return String(text[start:end])
+
+@primitive("string-append")
+def scheme_string_append(*strings):
+    return String("".join(_text(s, k, 'string-append')
+                          for k, s in enumerate(strings)))
+
+def _string_comparison(name, op):
+    """Define the primitive NAME, which is true if OP holds between the texts
+    of each consecutive pair of its string arguments."""
+    @primitive(name)
+    def compare(first, *rest):
+        texts = [_text(s, k, name) for k, s in enumerate((first,) + rest)]
+        return all(op(a, b) for a, b in zip(texts, texts[1:]))
+
+_string_comparison("string=?", operator.eq)
+_string_comparison("string<?", operator.lt)
+_string_comparison("string>?", operator.gt)
+_string_comparison("string<=?", operator.le)
+_string_comparison("string>=?", operator.ge)
+
+@primitive("string->symbol")
+def scheme_string_to_symbol(s):
+    return Symbol(_text(s, 0, 'string->symbol'))
+
+@primitive("symbol->string")
+def scheme_symbol_to_string(sym):
+    return String(str(check_type(sym, scheme_symbolp, 0, 'symbol->string')))
+
+@primitive("number->string")
+def scheme_number_to_string(n):
+    _check_nums(n)
+    return String(str(n))
+
+@primitive("string->number")
+def scheme_string_to_number(s):
+    """The number written as the text of S, or False if it is not one."""
+    text = _text(s, 0, 'string->number')
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return False
+
+@primitive("string->list")
+def scheme_string_to_list(s):
+    return scheme_list(*[String(c) for c in _text(s, 0, 'string->list')])
+
+@primitive("list->string")
+def scheme_list_to_string(x):
+    items = _list_items(x, 0, 'list->string')
+    return String("".join(_text(c, 0, 'list->string') for c in items))
+
+@primitive("string-upcase")
+def scheme_string_upcase(s):
+    return String(_text(s, 0, 'string-upcase').upper())
+
+@primitive("string-downcase")
+def scheme_string_downcase(s):
+    return String(_text(s, 0, 'string-downcase').lower())
+
+@primitive("string-contains")
+def scheme_string_contains(s, pattern):
+    """The index of the first occurrence of PATTERN in S, or False."""
+    text = _text(s, 0, 'string-contains')
+    k = text.find(_text(pattern, 1, 'string-contains'))
+    return False if k < 0 else k
+
+@primitive("string-split")
+def scheme_string_split(s, separator):
+    text = _text(s, 0, 'string-split')
+    parts = text.split(_text(separator, 1, 'string-split'))
+    return scheme_list(*[String(part) for part in parts])
+
+@primitive("string-join")
+def scheme_string_join(x, separator=None):
+    sep = "" if separator is None else _text(separator, 1, 'string-join')
+    items = _list_items(x, 0, 'string-join')
+    return String(sep.join(_text(s, 0, 'string-join') for s in items))
+
+def check_path(x, k, name):
+    """The file name given by X, argument K of NAME, which may be a string
+    or a symbol."""
+    if scheme_stringp(x):
+        return x.text
+    return str(check_type(x, scheme_symbolp, k, name))
+
+@primitive("file-exists?")
+def scheme_file_existsp(path):
+    return os.path.exists(check_path(path, 0, 'file-exists?'))
+
+@primitive("delete-file")
+def scheme_delete_file(path):
+    try:
+        os.remove(check_path(path, 0, 'delete-file'))
+    except OSError as err:
+        raise SchemeError(str(err))
+
+@primitive("temporary-file-name")
+def scheme_temporary_file_name(suffix=None):
+    """The name of a new, empty file in the temporary directory, ending in
+    SUFFIX, which no other call returns while it exists."""
+    suffix = "" if suffix is None else _text(suffix, 0, 'temporary-file-name')
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="scheme-")
+    os.close(fd)
+    return String(path)
+
+##
+## Ports
+##
+
+# The number of characters an output port collects before writing them
+BUFFER_SIZE = 1 << 16
+
+class OutputPort(object):
+    """An output port, which writes text to the Python file object file, or
+    to sys.stdout if file is None.  Text is collected until the port holds
+    capacity characters or is flushed, so that many small writes become one
+    write to the file."""
+
+    def __init__(self, file=None, capacity=BUFFER_SIZE):
+        self.file = file
+        self.capacity = capacity
+        self.buffer = []
+        self.size = 0
+        self.closed = False
+        _open_ports.add(self)
+
+    def __str__(self):
+        return "#[output-port]"
+
+    def write(self, text):
+        if self.closed:
+            raise SchemeError("write to a closed port")
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        """Write the collected text to the file, and flush the file."""
+        if self.closed:
+            return
+        file = sys.stdout if self.file is None else self.file
+        if self.buffer:
+            file.write("".join(self.buffer))
+            self.buffer, self.size = [], 0
+        file.flush()
+
+    def __del__(self):
+        try:
+            self.flush()
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+        self.closed = True
+
+class StringPort(OutputPort):
+    """An output port that accumulates text in an io.StringIO."""
+
+    def __init__(self):
+        OutputPort.__init__(self, io.StringIO(), 0)
+
+    def close(self):
+        self.closed = True
+
+    def getvalue(self):
+        return self.file.getvalue()
+
+# Ports that may hold unwritten text, which are flushed when they are
+# collected or, if they are still open, when Python exits
+_open_ports = weakref.WeakSet()
+
+@atexit.register
+def _flush_open_ports():
+    for port in list(_open_ports):
+        try:
+            port.flush()
+        except (OSError, ValueError):
+            pass
+
+_standard_output = OutputPort()
+_current_output = _standard_output
+
+@primitive("output-port?")
+def scheme_output_portp(x):
+    return isinstance(x, OutputPort)
+
+def _port(port, k, name):
+    """PORT, argument K of NAME, or the current output port if it is None."""
+    if port is None:
+        return _current_output
+    return check_type(port, scheme_output_portp, k, name)
+
+@primitive("current-output-port")
+def scheme_current_output_port():
+    return _current_output
+
+@primitive("flush-output")
+def scheme_flush_output(port=None):
+    _port(port, 0, 'flush-output').flush()
+
+@primitive("open-output-file")
+def scheme_open_output_file(path):
+    try:
+        return OutputPort(open(check_path(path, 0, 'open-output-file'), 'w'))
+    except OSError as err:
+        raise SchemeError(str(err))
+
+@primitive("close-output-port")
+def scheme_close_output_port(port):
+    _port(port, 0, 'close-output-port').close()
+
+@primitive("open-output-string")
+def scheme_open_output_string():
+    return StringPort()
+
+@primitive("get-output-string")
+def scheme_get_output_string(port):
+    if not isinstance(port, StringPort):
+        raise SchemeError(
+            "get-output-string of a port that is not a string port")
+    return String(port.getvalue())
+
+def _with_output_to(port, thunk, env):
+    """Call THUNK with PORT as the current output port, then close PORT."""
+    global _current_output
+    previous, _current_output = _current_output, port
+    try:
+        return complete_apply(thunk, [], env)
+    finally:
+        _current_output = previous
+        port.close()
+
+@primitive("with-output-to-file", use_env=True)
+def scheme_with_output_to_file(path, thunk, env):
+    return _with_output_to(scheme_open_output_file(path), thunk, env)
+
+@primitive("with-output-to-string", use_env=True)
+def scheme_with_output_to_string(thunk, env):
+    port = StringPort()
+    _with_output_to(port, thunk, env)
+    return String(port.getvalue())
+
+@primitive("call-with-output-file", use_env=True)
+def scheme_call_with_output_file(path, proc, env):
+    port = scheme_open_output_file(path)
+    try:
+        return complete_apply(proc, [port], env)
+    finally:
+        port.close()
+
+@primitive("call-with-output-string", use_env=True)
+def scheme_call_with_output_string(proc, env):
+    """Call PROC on a new string port and return the text written to it."""
+    port = StringPort()
+    complete_apply(proc, [port], env)
+    return String(port.getvalue())
+
+@primitive("write-string")
+def scheme_write_string(s, port=None):
+    _port(port, 1, 'write-string').write(_text(s, 0, 'write-string'))
+
+@primitive("write-char")
+def scheme_write_char(c, port=None):
+    text = _text(c, 0, 'write-char')
+    if len(text) != 1:
+        raise SchemeError("write-char of a string that is not one character")
+    _port(port, 1, 'write-char').write(text)
+
+class EofObject(object):
+    """The value read from an input port at its end."""
+
+    def __str__(self):
+        return "#[eof]"
+
+eof = EofObject()
+
+class InputPort(object):
+    """An input port, which reads text from the Python file object file, or
+    from sys.stdin if file is None.  The file is read one line at a time, as
+    its contents are needed; line is the current line and pos the position
+    of the next character in it."""
+
+    def __init__(self, file=None):
+        self.file = file
+        self.line = ""
+        self.pos = 0
+        self.line_number = 0
+        self.closed = False
+
+    def __str__(self):
+        return "#[input-port]"
+
+    def fill(self):
+        """Read the next line if the current one has been used up.  Returns
+        False at the end of the file."""
+        if self.pos < len(self.line):
+            return True
+        if self.closed:
+            raise SchemeError("read from a closed port")
+        file = sys.stdin if self.file is None else self.file
+        self.line, self.pos = file.readline(), 0
+        if self.line:
+            self.line_number += 1
+        return bool(self.line)
+
+    def tokens(self):
+        """An iterator over the remaining tokens, for a Buffer.  Each token
+        is consumed from the port only when the Buffer asks for it."""
+        while self.fill():
+            text, self.pos = next_candidate_token(self.line, self.pos)
+            if text is not None:
+                token = make_token(text)
+                if token is None:
+                    raise ValueError("invalid token: {0}".format(text))
+                yield [token]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.closed = True
+
+_current_input = InputPort()
+
+@primitive("input-port?")
+def scheme_input_portp(x):
+    return isinstance(x, InputPort)
+
+@primitive("eof-object?")
+def scheme_eof_objectp(x):
+    return x is eof
+
+@primitive("eof-object")
+def scheme_eof_object():
+    return eof
+
+def _input_port(port, k, name):
+    """PORT, argument K of NAME, or the current input port if it is None."""
+    if port is None:
+        return _current_input
+    return check_type(port, scheme_input_portp, k, name)
+
+@primitive("current-input-port")
+def scheme_current_input_port():
+    return _current_input
+
+@primitive("open-input-file")
+def scheme_open_input_file(path):
+    try:
+        return InputPort(open(check_path(path, 0, 'open-input-file')))
+    except OSError as err:
+        raise SchemeError(str(err))
+
+@primitive("open-input-string")
+def scheme_open_input_string(s):
+    return InputPort(io.StringIO(_text(s, 0, 'open-input-string')))
+
+@primitive("close-input-port")
+def scheme_close_input_port(port):
+    _input_port(port, 0, 'close-input-port').close()
+
+@primitive("read")
+def scheme_read_datum(port=None):
+    """The next datum from PORT, read without reading past its end."""
+    port = _input_port(port, 0, 'read')
+    try:
+        return literal_datum(scheme_read(Buffer(port.tokens())))
+    except EOFError:
+        return eof
+    except (SyntaxError, ValueError) as err:
+        raise SchemeError("{0} (line {1} of input)".format(
+            err, port.line_number))
+
+@primitive("read-line")
+def scheme_read_line(port=None):
+    port = _input_port(port, 0, 'read-line')
+    if not port.fill():
+        return eof
+    line = port.line[port.pos:]
+    port.pos = len(port.line)
+    return String(line[:-1] if line.endswith("\n") else line)
+
+@primitive("read-char")
+def scheme_read_char(port=None):
+    port = _input_port(port, 0, 'read-char')
+    if not port.fill():
+        return eof
+    port.pos += 1
+    return String(port.line[port.pos - 1])
+
+@primitive("peek-char")
+def scheme_peek_char(port=None):
+    port = _input_port(port, 0, 'peek-char')
+    if not port.fill():
+        return eof
+    return String(port.line[port.pos])
+
+@primitive("call-with-input-file", use_env=True)
+def scheme_call_with_input_file(path, proc, env):
+    port = scheme_open_input_file(path)
+    try:
+        return complete_apply(proc, [port], env)
+    finally:
+        port.close()
+
+@primitive("with-input-from-file", use_env=True)
+def scheme_with_input_from_file(path, thunk, env):
+    global _current_input
+    port = scheme_open_input_file(path)
+    previous, _current_input = _current_input, port
+    try:
+        return complete_apply(thunk, [], env)
+    finally:
+        _current_input = previous
+        port.close()
+
+@primitive("write")
+def scheme_write(val, port=None):
+    print_datum(val, _port(port, 1, 'write').write)
+
+def _print_limit(name, n):
+    """Set the limit PRINT_LIMITS[NAME] to N, or return it if N is None.  A
+    limit of False means no limit."""
+    if n is None:
+        limit = PRINT_LIMITS[name]
+        return False if limit is None else limit
+    if n is False:
+        PRINT_LIMITS[name] = None
+    else:
+        PRINT_LIMITS[name] = _check_count(n, 'print-' + name)
+
+@primitive("print-length")
+def scheme_print_length(n=None):
+    """Set or return the most elements of a list or vector that are printed."""
+    return _print_limit("length", n)
+
+@primitive("print-depth")
+def scheme_print_depth(n=None):
+    """Set or return the deepest nesting of lists and vectors that is
+    printed."""
+    return _print_limit("depth", n)
+
+@primitive("hash-consing")
+def scheme_hash_consing(on=None):
+    """Turn sharing of equal quoted and read lists on or off, or return a list
+    of the number of pairs read and the number kept while it has been on."""
+    if on is not None:
+        set_hash_consing(on is not False)
+        return
+    counts = hash_consing_counts()
+    return False if counts is None else scheme_list(*counts)
+
+##
+## Data files
+##
+
+# Records are read one at a time from files opened with a large buffer, and
+# passed to a Scheme procedure as they are read
+
+DATA_BUFFER_SIZE = 1 << 20
+
+def _open_data(path, name):
+    """Open the text file PATH, argument 0 of NAME, for reading records."""
+    try:
+        return open(check_path(path, 0, name), newline='',
+                    buffering=DATA_BUFFER_SIZE)
+    except OSError as err:
+        raise SchemeError(str(err))
+
+# Plain decimal numerals, which are the only fields read as numbers
+_CSV_INTEGER = re.compile(r"[+-]?[0-9]+\Z")
+_CSV_DECIMAL = re.compile(
+    r"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?\Z")
+
+def _csv_field(text):
+    """The number written as TEXT, or TEXT as a string.
+
+    >>> [_csv_field(t) for t in ["12", "-1.5", ".5e2", " 3"]]
+    [12, -1.5, 50.0, String(' 3')]
+    >>> [_csv_field(t) for t in ["nan", "inf", "1_000"]]
+    [String('nan'), String('inf'), String('1_000')]
+    """
+    if _CSV_INTEGER.match(text):
+        return int(text)
+    if _CSV_DECIMAL.match(text):
+        return float(text)
+    return String(text)
+
+def _csv_rows(path, header, name):
+    """Yield the rows of the CSV file PATH, passed to NAME, as vectors, or as
+    hash tables from column names to fields if HEADER is true.  A row with
+    more fields than the header has columns is an error."""
+    with _open_data(path, name) as f:
+        rows = csv.reader(f, strict=True)
+        try:
+            if scheme_true(header):
+                columns = [Symbol(column) for column in next(rows, [])]
+            for row in rows:
+                fields = [_csv_field(text) for text in row]
+                if scheme_false(header):
+                    yield Vector(fields)
+                    continue
+                if len(fields) > len(columns):
+                    msg = "{0}: {1} fields but {2} columns (line {3})"
+                    raise SchemeError(msg.format(name, len(fields),
+                                                 len(columns), rows.line_num))
+                table = HashTable(True)
+                for column, field in zip(columns, fields):
+                    table.entries[column] = (column, field)
+                yield table
+        except csv.Error as err:
+            raise SchemeError("{0}: {1} (line {2})".format(
+                name, err, rows.line_num))
+
+@primitive("csv-fold", use_env=True)
+def scheme_csv_fold(proc, init, path, *rest):
+    """Combine the rows of the CSV file PATH in order: (PROC row acc).  Each
+    row is a vector of fields, or if the optional header flag in REST is
+    true, a hash table from the column names in the first row to fields.
+    Numeric fields are numbers, and others are strings."""
+    header, env = rest if len(rest) > 1 else (False, rest[-1])
+    acc = init
+    for row in _csv_rows(path, header, 'csv-fold'):
+        acc = complete_apply(proc, [row, acc], env)
+    return acc
+
+@primitive("csv-for-each", use_env=True)
+def scheme_csv_for_each(proc, path, *rest):
+    """Call PROC on each row of the CSV file PATH, as in csv-fold."""
+    header, env = rest if len(rest) > 1 else (False, rest[-1])
+    for row in _csv_rows(path, header, 'csv-for-each'):
+        complete_apply(proc, [row], env)
+
+def _from_json(x):
+    """The Scheme value for the decoded JSON value X.  Objects are hash
+    tables keyed by symbols, arrays are vectors, and null is nil."""
+    if isinstance(x, str):
+        return String(x)
+    if isinstance(x, list):
+        return Vector([_from_json(y) for y in x])
+    if x is None:
+        return nil
+    return x
+
+def _json_object(pairs):
+    table = HashTable(True)
+    for key, value in pairs:
+        key = Symbol(key)
+        table.entries[key] = (key, _from_json(value))
+    return table
+
+def _jsonl_records(path, name):
+    """Yield the Scheme values of the JSON lines of the file PATH."""
+    with _open_data(path, name) as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield _from_json(json.loads(
+                        line, object_pairs_hook=_json_object))
+                except ValueError as err:
+                    raise SchemeError("{0}: {1} (line {2})".format(
+                        name, err, number))
+
+@primitive("jsonl-fold", use_env=True)
+def scheme_jsonl_fold(proc, init, path, env):
+    """Combine the values of the JSON lines of the file PATH in order:
+    (PROC value acc)."""
+    acc = init
+    for record in _jsonl_records(path, 'jsonl-fold'):
+        acc = complete_apply(proc, [record, acc], env)
+    return acc
+
+@primitive("jsonl-for-each", use_env=True)
+def scheme_jsonl_for_each(proc, path, env):
+    """Call PROC on the value of each JSON line of the file PATH."""
+    for record in _jsonl_records(path, 'jsonl-for-each'):
+        complete_apply(proc, [record], env)
+
 ##
 ## Other operations
 ##
@@ -259,24 +1739,30 @@ def scheme_atomp(x):
         return True
     if scheme_nullp(x):
         return True
+    if scheme_vectorp(x) or isinstance(x, NumericVector):
+        return True
+    if scheme_hash_tablep(x):
+        return True
+    if scheme_stringp(x):
+        return True
     return False
 
 @primitive("display")
-def scheme_display(val):
-    print(str(val), end="")
+def scheme_display(val, port=None):
+    print_datum(val, _port(port, 1, 'display').write, True)
 
 @primitive("print")
 def scheme_print(val):
-    print(str(val))
+    print_datum(val, _current_output.write)
+    _current_output.write("\n")
 
 @primitive("newline")
-def scheme_newline():
-    print()
-    sys.stdout.flush()
+def scheme_newline(port=None):
+    _port(port, 0, 'newline').write("\n")
 
 @primitive("error")
 def scheme_error(msg = None):
-    msg = "" if msg is None else str(msg)
+    msg = "" if msg is None else _display_text(msg)
     raise SchemeError(msg)
 
 @primitive("exit")
@@ -2,9 +2,9 @@
 with a parser for Scheme expressions.
 
 In addition to the types defined in this file, some data types in Scheme are
-represented by their corresponding type in Python:
+represented by their corresponding type in Python, and symbols and strings by
+the Symbol and String types of scheme_tokens:
     number:       int or float
-    symbol:       string
     boolean:      bool
     unspecified:  None
 
@@ -15,8 +15,9 @@ The __str__ method of a Scheme value will return a Scheme expression that
 would be read to the value, where possible.
 """
 
+import weakref
 from ucb import main, trace, interact
-from scheme_tokens import tokenize_lines, DELIMITERS
+from scheme_tokens import tokenize_lines, DELIMITERS, Symbol, String
 from buffer import Buffer, InputReader, LineReader
 
 # Pairs and Scheme lists
@@ -43,17 +44,15 @@ class Pair(object):
         self.second = second
 
     def __repr__(self):
-        return "Pair({0}, {1})".format(repr(self.first), repr(self.second))
-
-    def __str__(self):
-        s = "(" + str(self.first)
-        second = self.second
+        firsts, second = [repr(self.first)], self.second
         while isinstance(second, Pair):
-            s += " " + str(second.first)
+            firsts.append(repr(second.first))
             second = second.second
-        if second is not nil:
-            s += " . " + str(second)
-        return s + ")"
+        heads = "".join("Pair({0}, ".format(first) for first in firsts)
+        return heads + repr(second) + ")" * len(firsts)
+
+    def __str__(self):
+        return datum_text(self)
 
     def __len__(self):
         n, second = 1, self.second
@@ -76,6 +75,22 @@ class Pair(object):
             y = y.second
         return y.first
 
+    def __reduce__(self):
+        # Pickle the elements of a list rather than nested pairs, so that long
+        # lists do not exhaust the recursion limit of pickle
+        firsts, second = [self.first], self.second
+        seen = {node_key(self)} if _mutated else None
+        while isinstance(second, Pair) and not (isinstance(second, CompactList)
+                                                and second.compact()):
+            if seen is not None:
+                key = node_key(second)
+                if key in seen:
+                    raise ValueError("cannot pickle a cyclic list")
+                seen.add(key)
+            firsts.append(second.first)
+            second = second.second
+        return (_unpickle_list, (firsts, second))
+
     def map(self, fn):
         """Return a Scheme list after mapping Python function FN to SELF."""
         mapped = fn(self.first)
@@ -104,10 +119,509 @@ class nil(object):
     def map(self, fn):
         return self
 
+    def __reduce__(self):
+        return "nil" # Unpickled as the module's one instance
+
 nil = nil() # Assignment hides the nil class; there is only one instance
 
+def _unpickle_list(firsts, second):
+    """The list of FIRSTS followed by SECOND, pickled by Pair.__reduce__."""
+    for first in reversed(firsts):
+        second = Pair(first, second)
+    return second
+
+# Compact lists
+
+class CompactList(Pair):
+    """A proper list stored as the elements of a Python list from index start
+    on, which behaves as a chain of pairs.  Its second is a view of the same
+    elements from the next index, made when it is first needed, so a long list
+    costs one Python list rather than a pair per element, and has
+    constant-time length and indexing.
+
+    Setting first stores into the shared elements.  Setting second records a
+    new tail, after which the views of those elements are walked like pairs.
+
+    >>> s = compact_list([1, 2, 3])
+    >>> print(s), print(s.second), len(s.second), s[2]
+    (1 2 3)
+    (2 3)
+    (None, None, 2, 3)
+    >>> s.second is s.second, s.second.second.second
+    (True, nil)
+    >>> s.second.first = 4
+    >>> s.second.second = Pair(5, nil)
+    >>> print(s), len(s), s.elements()
+    (1 4 5)
+    (None, 3, None)
+    """
+    def __init__(self, cells, start):
+        self.cells = cells
+        self.start = start
+
+    @property
+    def first(self):
+        return self.cells.items[self.start]
+
+    @first.setter
+    def first(self, value):
+        self.cells.items[self.start] = value
+
+    @property
+    def second(self):
+        cells, k = self.cells, self.start
+        if cells.tails is not None and k in cells.tails:
+            return cells.tails[k]
+        return cells.view(k + 1)
+
+    @second.setter
+    def second(self, value):
+        cells = self.cells
+        if cells.tails is None:
+            cells.tails = {}
+        cells.tails[self.start] = value
+
+    def compact(self):
+        """Whether no second of the elements of SELF has been set."""
+        return self.cells.tails is None
+
+    def elements(self):
+        """The elements of SELF as a new Python list, or None if a second has
+        been set."""
+        if self.cells.tails is None:
+            return self.cells.items[self.start:]
+
+    def tail(self, k):
+        """The list of the elements of SELF after the first K, or None if a
+        second has been set."""
+        if (self.cells.tails is None and
+                self.start + k <= len(self.cells.items)):
+            return self.cells.view(self.start + k)
+
+    def __len__(self):
+        if self.cells.tails is not None:
+            return Pair.__len__(self)
+        return len(self.cells.items) - self.start
+
+    def __getitem__(self, k):
+        if self.cells.tails is not None or k < 0:
+            return Pair.__getitem__(self, k)
+        if self.start + k >= len(self.cells.items):
+            raise IndexError("list index out of bounds")
+        return self.cells.items[self.start + k]
+
+    def __reduce__(self):
+        if not self.compact():
+            return Pair.__reduce__(self)
+        return (compact_list, (self.elements(),))
+
+    def map(self, fn):
+        elements = self.elements()
+        if elements is None:
+            return Pair.map(self, fn)
+        return compact_list([fn(x) for x in elements])
+
+class _Cells(object):
+    """The elements shared by the views of a compact list."""
+    __slots__ = ("items", "views", "tails")
+
+    def __init__(self, items):
+        self.items = items
+        self.views = {}   # index -> weak reference to a live CompactList
+        self.tails = None # index -> second, once set
+
+    def view(self, k):
+        """The list of the elements from index K, which is the same object
+        for as long as it is referenced."""
+        if k == len(self.items):
+            return nil
+        views = self.views
+        ref = views.get(k)
+        view = None if ref is None else ref()
+        if view is None:
+            view = CompactList(self, k)
+            views[k] = weakref.ref(view, lambda ref: views.pop(k, None))
+        return view
+
+def compact_list(items):
+    """The Scheme list of the elements of the Python list ITEMS, which it
+    takes ownership of."""
+    return _Cells(items).view(0) if items else nil
+
+def compact_datum(x):
+    """X with its proper lists, and those nested in it, made compact.
+
+    >>> s = compact_datum(read_line("(1 (2 3) #((4)) ((5) . 6))"))
+    >>> print(s), [type(y).__name__ for y in s.elements()]
+    (1 (2 3) #((4)) ((5) . 6))
+    (None, ['int', 'CompactList', 'Vector', 'Pair'])
+    >>> type(s[3].first).__name__
+    'CompactList'
+    """
+    if isinstance(x, Vector):
+        x.items[:] = [compact_datum(y) for y in x.items]
+        return x
+    if not isinstance(x, Pair):
+        return x
+    items = []
+    y = x
+    while isinstance(y, Pair):
+        items.append(compact_datum(y.first))
+        y = y.second
+    if y is not nil:
+        y = x
+        for item in items:
+            y.first, y = item, y.second
+        return x
+    return compact_list(items)
+
+# Vectors
+
+class Vector(object):
+    """A vector is a fixed-length sequence of Scheme values with constant-time
+    access to its elements, which are stored in the Python list items.
+
+    >>> v = Vector([1, Pair(2, nil), 3])
+    >>> v
+    Vector([1, Pair(2, nil), 3])
+    >>> print(v)
+    #(1 (2) 3)
+    >>> len(v)
+    3
+    >>> v[2]
+    3
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return "Vector({0})".format(repr(self.items))
+
+    def __str__(self):
+        return datum_text(self)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, k):
+        return self.items[k]
+
+class NumericVector(object):
+    """A numeric vector is a homogeneous vector of machine numbers, such as
+    the f64vector of 64-bit floats.  TAG names its element type, and its
+    elements are stored in data, a sequence supporting the buffer protocol
+    (an array.array, or a memoryview of some other buffer).
+
+    >>> from array import array
+    >>> v = NumericVector('f64', array('d', [1, 2.5]))
+    >>> v
+    NumericVector('f64', array('d', [1.0, 2.5]))
+    >>> print(v)
+    #f64(1.0 2.5)
+    >>> len(v)
+    2
+    """
+    def __init__(self, tag, data):
+        self.tag = tag
+        self.data = data
+
+    def __repr__(self):
+        return "NumericVector({0}, {1})".format(repr(self.tag),
+                                                repr(self.data))
+
+    def __str__(self):
+        return "#" + self.tag + "(" + " ".join(map(str, self.data)) + ")"
+
+    def __len__(self):
+        return len(self.data)
+
+# Hash tables
+
+def hash_key(x, structural):
+    """Return a hashable Python value identifying the Scheme value X as a hash
+    table key.  Booleans are distinguished from the numbers 0 and 1.  If
+    STRUCTURAL, lists and vectors are identified by their elements, and
+    otherwise by their identity.
+
+    >>> key = hash_key(read_line("(1 (2 #t) . 3)"), True)
+    >>> key[:2], key[3]
+    ((<class 'scheme_reader.Pair'>, 1), 3)
+    >>> key[2]
+    (<class 'scheme_reader.Pair'>, 2, (<class 'bool'>, True), nil)
+    >>> hash_key(1, True) == hash_key(True, True)
+    False
+    """
+    if x is True or x is False:
+        return (bool, x)
+    if not structural:
+        return x
+    if isinstance(x, Pair):
+        key = [Pair]
+        while isinstance(x, Pair):
+            key.append(hash_key(x.first, True))
+            x = x.second
+        key.append(hash_key(x, True))
+        return tuple(key)
+    if isinstance(x, Vector):
+        return (Vector,) + tuple(hash_key(y, True) for y in x.items)
+    if isinstance(x, NumericVector):
+        return (NumericVector, x.tag) + tuple(x.data)
+    if isinstance(x, String):
+        return (String, x.text)
+    return x
+
+class HashTable(object):
+    """A hash table maps Scheme keys to values with constant-time access.
+    Keys are compared by equal? if the table is STRUCTURAL, and by eq?
+    otherwise.  The dict entries maps the hash_key of each key to a
+    (key, value) tuple.
+
+    >>> t = HashTable(True)
+    >>> t.entries[t.key(read_line("(a b)"))] = (read_line("(a b)"), 1)
+    >>> t.key(read_line("(a b)")) in t.entries
+    True
+    >>> print(t)
+    #[hash-table 1]
+    """
+    def __init__(self, structural):
+        self.structural = structural
+        self.entries = {}
+
+    def key(self, x):
+        """The key under which the entry for Scheme key X is stored."""
+        return hash_key(x, self.structural)
+
+    def __repr__(self):
+        return "HashTable({0}, {1})".format(self.structural,
+                                            repr(self.entries))
+
+    def __str__(self):
+        return "#[hash-table {0}]".format(len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+# Printing
+
+# The most elements of a list or vector, and the deepest nesting of lists and
+# vectors, that are printed (no limit if None)
+PRINT_LIMITS = {"length": None, "depth": None}
+
+# Structures built without mutation cannot be cyclic, so printing searches
+# for cycles only once a pair or vector has been mutated
+_mutated = False
+
+def mark_mutated():
+    """Record that a pair or vector has been mutated."""
+    global _mutated
+    _mutated = True
+
+def node_key(node):
+    """A key for the pair or vector NODE that is the same for every view of
+    one cell of a compact list, since those views are made and discarded
+    as the list is traversed and their ids may be reused."""
+    if isinstance(node, CompactList):
+        return id(node.cells), node.start
+    return id(node)
+
+def cycle_targets(x):
+    """The set of node_keys of the pairs and vectors in X that are reachable
+    from themselves, found without recursion."""
+    targets = set()
+    if not _mutated:
+        return targets
+    on_path = {}  # True while a node's descendants are searched, then False
+    stack = [(x, False)]
+    while stack:
+        node, leaving = stack.pop()
+        if leaving:
+            on_path[node_key(node)] = False
+        elif isinstance(node, (Pair, Vector)):
+            key = node_key(node)
+            if key in on_path:
+                if on_path[key]:
+                    targets.add(key)
+                continue
+            on_path[key] = True
+            stack.append((node, True))
+            if isinstance(node, Pair):
+                stack.append((node.second, False))
+                stack.append((node.first, False))
+            else:
+                stack.extend((item, False) for item in reversed(node.items))
+    return targets
+
+def print_datum(x, write, display=False):
+    """Print the Scheme value X by calling WRITE on successive pieces of its
+    text.  Strings are printed as their characters if DISPLAY, and as
+    string literals otherwise.
+
+    Lists are traversed iteratively, with an explicit stack for the lists
+    and vectors that contain them.  Elements beyond PRINT_LIMITS["length"]
+    are printed as ..., and lists or vectors nested deeper than
+    PRINT_LIMITS["depth"] as #.  A list or vector that contains itself is
+    labeled #n= where it starts and printed as #n# where it recurs.
+
+    >>> x = read_line('(1 (2 (3)) #(4 "five") . 6)')
+    >>> print_datum(x, lambda text: print(text, end="|"))
+    (|1| |(|2| |(|3|)|)| |#(|4| |"five"|)| . |6|)|
+    >>> x.second.second.second = x
+    >>> mark_mutated()
+    >>> print(x)
+    #0=(1 (2 (3)) #(4 "five") . #0#)
+    """
+    max_length, max_depth = PRINT_LIMITS["length"], PRINT_LIMITS["depth"]
+    targets = cycle_targets(x)
+    labels = {}
+    # [rest of a list or items of a vector, depth, elements printed]
+    stack = []
+    value, depth, pending = x, 0, True
+    while True:
+        if pending:
+            pending = False
+            if not isinstance(value, (Pair, Vector)):
+                if display and isinstance(value, String):
+                    write(value.text)
+                else:
+                    write(str(value))
+            elif node_key(value) in labels:
+                write("#{0}#".format(labels[node_key(value)]))
+            elif max_depth is not None and depth >= max_depth:
+                write("#")
+            else:
+                key = node_key(value)
+                if key in targets:
+                    labels[key] = len(labels)
+                    write("#{0}=".format(labels[key]))
+                if isinstance(value, Pair):
+                    write("(")
+                    stack.append([value, depth, 0])
+                else:
+                    write("#(")
+                    stack.append([value.items, depth, 0])
+        if not stack:
+            return
+        top = stack[-1]
+        rest, depth, count = top
+        if isinstance(rest, list):
+            done = count == len(rest)
+        else:
+            done = rest is nil
+            if not done and (count and node_key(rest) in targets or
+                             not isinstance(rest, Pair)):
+                # A dotted tail; a label must start a list, so one is printed
+                # as the tail of the list that refers to it
+                write(" . ")
+                value, top[0], pending = rest, nil, True
+                continue
+        if done:
+            write(")")
+            stack.pop()
+        elif max_length is not None and count >= max_length:
+            write(" ...)" if count else "...)")
+            stack.pop()
+        else:
+            if count:
+                write(" ")
+            if isinstance(rest, list):
+                value = rest[count]
+            else:
+                value, top[0] = rest.first, rest.second
+            depth, pending, top[2] = depth + 1, True, count + 1
+
+def datum_text(x, display=False):
+    """The text that print_datum prints for X."""
+    pieces = []
+    print_datum(x, pieces.append, display)
+    return "".join(pieces)
+
+# Hash consing
+
+class SharedPair(Pair):
+    """A pair of hash-consed structure, which is shared by every occurrence
+    of an equal list read while hash consing is on, and so must not be
+    mutated."""
+
+class HashConser(object):
+    """A table of the shared copies of structure read while hash consing.
+    Lists are shared if their elements are equal numbers, booleans, symbols
+    or strings, or are themselves shared.  Vectors are not shared, since
+    they can be mutated, but their elements are.
+
+    >>> h = HashConser()
+    >>> x = h.share(read_line("((1 2) (1 2) (0 1 2))"))
+    >>> x.first is x.second.first, x.first is x.second.second.first.second
+    (True, True)
+    >>> h.read, len(h.pairs)
+    (10, 6)
+    """
+
+    def __init__(self):
+        self.pairs = {}    # (first key, second key) -> SharedPair
+        self.strings = {}  # text -> String
+        self.read = 0      # The number of pairs passed to share
+
+    def share(self, x):
+        """The shared copy of X."""
+        if isinstance(x, String):
+            return self.strings.setdefault(x.text, x)
+        if isinstance(x, Vector):
+            x.items[:] = [self.share(y) for y in x.items]
+            return x
+        if not isinstance(x, Pair):
+            return x
+        firsts = []
+        while isinstance(x, Pair):
+            firsts.append(self.share(x.first))
+            x = x.second
+        rest = self.share(x)
+        for first in reversed(firsts):
+            key = (_share_key(first), _share_key(rest))
+            pair = self.pairs.get(key)
+            if pair is None:
+                pair = self.pairs[key] = SharedPair(first, rest)
+            rest = pair
+        self.read += len(firsts)
+        return rest
+
+def _share_key(x):
+    """A key that is equal for values that are shared when equal."""
+    if isinstance(x, (int, float, Symbol)):
+        return (type(x), x)
+    return id(x)  # Shared or unique, and kept alive by a HashConser
+
+# The active HashConser, or None if hash consing is off
+hash_conser = None
+
+def set_hash_consing(on):
+    """Start sharing quoted structure in a new table if ON, or stop."""
+    global hash_conser
+    hash_conser = HashConser() if on else None
+
+def hash_consing_counts():
+    """The number of pairs read and the number kept while hash consing, or
+    None if it is off."""
+    if hash_conser is None:
+        return None
+    return hash_conser.read, len(hash_conser.pairs)
+
+def literal_datum(x):
+    """The datum X, quoted or read as data, as it is kept: shared if hash
+    consing is on, or made compact otherwise."""
+    if hash_conser is None:
+        return compact_datum(x)
+    return hash_conser.share(x)
+
 # Scheme list parser
 
+# The special forms abbreviated by quotation marks
+QUOTES = {
+    "'": Symbol("quote"),
+    "`": Symbol("quasiquote"),
+    ",": Symbol("unquote"),
+    ",@": Symbol("unquote-splicing"),
+}
+
 def scheme_read(src):
     """Read the next expression from SRC, a Buffer of tokens.
 
@@ -119,6 +633,10 @@ def scheme_read(src):
     Pair('quote', Pair('hello', nil))
     >>> print(read_line("(car '(1 2))"))
     (car (quote (1 2)))
+    >>> read_line("#(1 (2) #t)")
+    Vector([1, Pair(2, nil), True])
+    >>> print(read_line("`(a ,b ,@c)"))
+    (quasiquote (a (unquote b) (unquote-splicing c)))
     """
     if src.current() is None:
         raise EOFError
@@ -127,11 +645,16 @@ def scheme_read(src):
         return nil
     elif val not in DELIMITERS:
         return val
-    elif val == "'":
+    elif val in QUOTES:
         "*** YOUR CODE HERE ***"
-        return Pair('quote', Pair(scheme_read(src), nil))
+        datum = scheme_read(src)
+        if val == "'":
+            datum = literal_datum(datum)
+        return Pair(QUOTES[val], Pair(datum, nil))
     elif val == "(":
         return read_tail(src)
+    elif val == "#(":
+        return read_vector_tail(src)
     else:
         raise SyntaxError("unexpected token: {0}".format(val))
 
@@ -174,6 +697,29 @@ def read_tail(src):
 
     return Pair(first, rest)
 
+def read_vector_tail(src):
+    """Return the Vector whose elements are the remainder of SRC, starting
+    before an element or ).
+
+    >>> read_vector_tail(Buffer(tokenize_lines(["1 2)"])))
+    Vector([1, 2])
+    >>> read_line("#()")
+    Vector([])
+    >>> read_line("#(1 . 2)")
+    Traceback (most recent call last):
+        ...
+    SyntaxError: unexpected token: .
+    """
+    items = []
+    while src.current() != ")":
+        if src.current() is None:
+            raise SyntaxError("unexpected end of file")
+        if src.current() == ".":
+            raise SyntaxError("unexpected token: .")
+        items.append(scheme_read(src))
+    src.pop()
+    return Vector(items)
+
 # Convenience methods
 
 def buffer_input(prompt="scm> "):
@@ -1,6 +1,8 @@
-"""Unit testing framework for the Logo interpreter.
+"""Unit testing framework for the Scheme interpreter.
 
-Usage: python3 scheme_test.py FILE
+Usage: python3 scheme_test.py [-O] [-j JOBS] [--timeout SECONDS]
+                              [--slowest N] [--budget SECONDS]
+                              [--junit FILE] [--json FILE] FILE ...
 
 Interprets FILE as interactive Scheme source code, and compares each line
 of printed output from the read-eval-print loop and from any output functions
@@ -10,31 +12,97 @@ to an expected output described in a comment.  For example,
 ; expect 5
 
 Differences between printed and expected outputs are printed with line numbers.
+
+With -O, each form is passed through the optimization pass of scheme.py
+before it is evaluated, so the same tests check the optimized program.
+
+With --slowest or --budget, each top-level form is timed.  The N slowest
+forms of each file are listed by line, and a form that takes longer than the
+budget counts as a failed test.
+
+Given several files or glob patterns, or a timeout or report option, each file
+is run in its own process with a fresh global frame, JOBS at a time.  The
+result of each file is printed as soon as it finishes, followed by a summary,
+and the results can also be written as JUnit XML or JSON.
 """
 
+import argparse
+import collections
+import glob
 import io
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
 import sys
+import time
+import xml.etree.ElementTree as ElementTree
 from buffer import Buffer
-from scheme import read_eval_print_loop, create_global_frame
+from scheme import read_eval_print_loop, create_global_frame, shutdown_parallel
 from scheme_tokens import tokenize_lines
 from ucb import main
 
-def summarize(output, expected_output):
-    """Summarize results of running tests."""
-    num_failed, num_expected = 0, len(expected_output)
+def check_output(output, expected_output):
+    """Return a list of (line number, expected, printed) for each test whose
+    printed output does not match its expected output."""
+    failures = []
     for (actual, (expected, line_number)) in zip(output, expected_output):
         if expected.startswith("Error"):
             if not actual.startswith("Error"):
-                num_failed += 1
-                print('test failed at line {0}'.format(line_number))
-                print('  expected an error indication')
-                print('   printed: {0}'.format(actual))
+                failures.append((line_number, expected, actual))
         elif actual != expected:
-            num_failed += 1
-            print('test failed at line {0}'.format(line_number))
-            print('  expected: {0}'.format(expected))
-            print('   printed: {0}'.format(actual))
-    print('{0} tested; {1} failed.'.format(num_expected, num_failed))
+            failures.append((line_number, expected, actual))
+    return failures
+
+def failure_lines(failures):
+    """Yield the lines that describe FAILURES, as returned by check_output."""
+    for line_number, expected, actual in failures:
+        yield 'test failed at line {0}'.format(line_number)
+        if expected.startswith("Error"):
+            yield '  expected an error indication'
+        else:
+            yield '  expected: {0}'.format(expected)
+        yield '   printed: {0}'.format(actual)
+
+def over_budget(times, budget):
+    """Return a list of (line number, seconds) for each form in TIMES, a list
+    of the same, that took longer than BUDGET seconds."""
+    if budget is None:
+        return []
+    return [(line, seconds) for line, seconds in times if seconds > budget]
+
+def budget_lines(slow, budget):
+    """Yield the lines that describe the forms in SLOW, which went over
+    BUDGET seconds."""
+    for line_number, seconds in slow:
+        yield 'form at line {0} took {1:.3f}s, over its budget of {2}s'.format(
+            line_number, seconds, budget)
+
+def slowest_forms(times, n, lines):
+    """Return a list of (line number, seconds, source) for the N slowest
+    forms in TIMES, whose source is in LINES."""
+    slowest = sorted(times, key=lambda form: form[1], reverse=True)[:n]
+    return [(line, seconds, lines[line - 1].strip()[:60])
+            for line, seconds in slowest]
+
+def slowest_lines(slowest):
+    """Yield the lines that list SLOWEST, as returned by slowest_forms."""
+    if slowest:
+        yield 'slowest {0} forms:'.format(len(slowest))
+    for line_number, seconds, source in slowest:
+        yield '  {0:8.3f}s  line {1}: {2}'.format(seconds, line_number, source)
+
+def summarize(output, expected_output, slow=(), budget=None):
+    """Summarize results of running tests.  SLOW lists the forms that went
+    over BUDGET seconds."""
+    failures = check_output(output, expected_output)
+    for line in failure_lines(failures):
+        print(line)
+    for line in budget_lines(slow, budget):
+        print(line)
+    print('{0} tested; {1} failed.'.format(len(expected_output) + len(slow),
+                                           len(failures) + len(slow)))
 
 EXPECT_STRING = '; expect'
 
@@ -55,23 +123,269 @@ class TestReader(object):
             yield line
         raise EOFError
 
-@main
-def run_tests(src_file = 'tests.scm'):
-    """Run a read-eval loop that reads from src_file and collects outputs."""
+def run_file(reader, times=None, optimized=False):
+    """Run a read-eval loop in a fresh global frame on the lines of READER, a
+    TestReader, and return the lines printed to stdout and stderr.  If TIMES
+    is a list, the line number and seconds taken of each form are appended to
+    it.  If OPTIMIZED, each form is optimized before it is evaluated."""
+    timer = None
+    if times is not None:
+        timer = lambda line, seconds: times.append((line, seconds))
+    stdout, stderr = sys.stdout, sys.stderr
     sys.stderr = sys.stdout = io.StringIO() # Collect output to stdout and stderr
     try:
-        reader = TestReader(open(src_file).readlines())
         src = Buffer(tokenize_lines(reader))
         def next_line():
             src.current()
             return src
-        read_eval_print_loop(next_line, create_global_frame())
+        read_eval_print_loop(next_line, create_global_frame(), optimized,
+                             timer=timer)
+        return sys.stdout.getvalue().split('\n')
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+##
+## Running many files
+##
+
+def test_file(src_file, slowest=0, budget=None, optimized=False):
+    """Run the tests in SRC_FILE, OPTIMIZED or not, and return a dict of their
+    results: the line numbers of its tests, the failures among them, the
+    forms that went over BUDGET seconds, the SLOWEST slowest forms, and any
+    error that stopped the file."""
+    start = time.perf_counter()
+    result = {"file": src_file, "tests": [], "failures": [], "slow": [],
+              "slowest": [], "error": None}
+    reader = None
+    times = [] if slowest or budget is not None else None
+    try:
+        with open(src_file) as infile:
+            reader = TestReader(infile.readlines())
+        output = run_file(reader, times, optimized)
+        result["failures"] = check_output(output, reader.expected_output)
+    except OSError as err:
+        result["error"] = str(err)
+    except BaseException as exc:
+        line_number = 0 if reader is None else reader.line_number
+        result["error"] = "unhandled exception after line {0}: {1!r}".format(
+            line_number, exc)
+    if reader is not None:
+        result["tests"] = [line for _, line in reader.expected_output]
+    if times:
+        result["slow"] = over_budget(times, budget)
+        result["slowest"] = slowest_forms(times, slowest, reader.lines)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def _test_file_to(conn, *args):
+    """Send the results of test_file called on ARGS through the connection
+    CONN, from a new process group that holds any workers it starts."""
+    os.setpgrp()
+    try:
+        conn.send(test_file(*args))
+        conn.close()
+    finally:
+        shutdown_parallel()
+
+def _stopped(src_file, error, start):
+    """The results of SRC_FILE, whose process started at START, if it was
+    stopped by ERROR before it could report them."""
+    return {"file": src_file, "tests": [], "failures": [], "slow": [],
+            "slowest": [], "error": error,
+            "seconds": time.perf_counter() - start}
+
+def test_files(src_files, jobs, timeout=None, slowest=0, budget=None,
+               optimized=False):
+    """Test each of SRC_FILES in its own process, at most JOBS at a time, and
+    yield the results of each as it finishes.  A file still running after
+    TIMEOUT seconds is stopped and reported as an error.  SLOWEST, BUDGET and
+    OPTIMIZED are passed to test_file.
+
+    Each file gets a new process, rather than a reused pool worker, so that it
+    starts from a fresh interpreter and can be killed, along with any workers
+    of its own, when it times out."""
+    pending = collections.deque(src_files)
+    running = {} # Connection -> (process, file, start time)
+    while pending or running:
+        while pending and len(running) < jobs:
+            src_file = pending.popleft()
+            recv, send = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_test_file_to,
+                args=(send, src_file, slowest, budget, optimized))
+            process.start()
+            send.close()
+            running[recv] = (process, src_file, time.perf_counter())
+        wait = None
+        if timeout is not None:
+            first_start = min(start for _, _, start in running.values())
+            wait = max(0, first_start + timeout - time.perf_counter())
+        for conn in multiprocessing.connection.wait(list(running), wait):
+            process, src_file, start = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                process.join()
+                result = _stopped(src_file, "process exited with code {0}"
+                                  .format(process.exitcode), start)
+            process.join()
+            conn.close()
+            yield result
+        now = time.perf_counter()
+        for conn, (process, src_file, start) in list(running.items()):
+            if timeout is not None and now - start >= timeout:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.join()
+                conn.close()
+                del running[conn]
+                message = "timed out after {0}s".format(timeout)
+                yield _stopped(src_file, message, start)
+
+def print_result(result, budget=None):
+    """Print a line describing RESULT, followed by its failures, the forms
+    that went over BUDGET seconds, and its slowest forms."""
+    if result["error"] is not None:
+        status = "error: " + result["error"]
+    else:
+        status = '{0} tested; {1} failed'.format(
+            len(result["tests"]) + len(result["slow"]),
+            len(result["failures"]) + len(result["slow"]))
+    print('{0}: {1} ({2:.2f}s)'.format(result["file"], status,
+                                        result["seconds"]))
+    for line in failure_lines(result["failures"]):
+        print('  ' + line)
+    for line in budget_lines(result["slow"], budget):
+        print('  ' + line)
+    for line in slowest_lines(result["slowest"]):
+        print('  ' + line)
+    sys.stdout.flush()
+
+def totals(results):
+    """The numbers of tests, failures and errors in RESULTS, where each form
+    that went over budget is a failed test."""
+    return (sum(len(r["tests"]) + len(r["slow"]) for r in results),
+            sum(len(r["failures"]) + len(r["slow"]) for r in results),
+            sum(r["error"] is not None for r in results))
+
+def write_junit(results, seconds, path, budget=None):
+    """Write RESULTS, which took SECONDS in all, as JUnit XML to PATH, with a
+    failed test case for each form that went over BUDGET seconds."""
+    tested, failed, errors = totals(results)
+    suites = ElementTree.Element("testsuites", tests=str(tested),
+                                 failures=str(failed), errors=str(errors),
+                                 time="{0:.3f}".format(seconds))
+    for result in results:
+        suite = ElementTree.SubElement(
+            suites, "testsuite", name=result["file"],
+            tests=str(len(result["tests"]) + len(result["slow"])),
+            failures=str(len(result["failures"]) + len(result["slow"])),
+            errors=str(int(result["error"] is not None)),
+            time="{0:.3f}".format(result["seconds"]))
+        failures = {line: (expected, actual)
+                    for line, expected, actual in result["failures"]}
+        for line in result["tests"]:
+            case = ElementTree.SubElement(suite, "testcase",
+                                          classname=result["file"],
+                                          name="line {0}".format(line))
+            if line in failures:
+                expected, actual = failures[line]
+                ElementTree.SubElement(case, "failure", message=
+                    "expected: {0}; printed: {1}".format(expected, actual))
+        for line, message in zip(result["slow"],
+                                 budget_lines(result["slow"], budget)):
+            name = "form at line {0}".format(line[0])
+            case = ElementTree.SubElement(suite, "testcase",
+                                          classname=result["file"], name=name,
+                                          time="{0:.3f}".format(line[1]))
+            ElementTree.SubElement(case, "failure", message=message)
+        if result["error"] is not None:
+            case = ElementTree.SubElement(suite, "testcase",
+                                          classname=result["file"],
+                                          name="run")
+            ElementTree.SubElement(case, "error", message=result["error"])
+    ElementTree.ElementTree(suites).write(path, encoding="utf-8",
+                                          xml_declaration=True)
+
+def write_json(results, seconds, path):
+    """Write RESULTS, which took SECONDS in all, as JSON to PATH."""
+    tested, failed, errors = totals(results)
+    files = [dict(result, failures=[
+                {"line": line, "expected": expected, "printed": actual}
+                for line, expected, actual in result["failures"]])
+             for result in results]
+    with open(path, "w") as outfile:
+        json.dump({"tested": tested, "failed": failed, "errors": errors,
+                   "seconds": seconds, "files": files}, outfile, indent=2)
+
+def expand_patterns(patterns):
+    """The files named by PATTERNS, with glob patterns expanded.  A pattern
+    that matches nothing is kept, so that it is reported as missing."""
+    src_files = []
+    for pattern in patterns:
+        src_files.extend(sorted(glob.glob(pattern)) or [pattern])
+    return src_files
+
+def run_many(src_files, jobs, timeout, slowest, budget, optimized, junit,
+             json_path):
+    """Test SRC_FILES in parallel, printing results as they finish, and exit
+    with status 1 if any test failed or any file did not finish."""
+    start = time.perf_counter()
+    results = []
+    for result in test_files(src_files, jobs, timeout, slowest, budget,
+                             optimized):
+        print_result(result, budget)
+        results.append(result)
+    seconds = time.perf_counter() - start
+    order = {src_file: i for i, src_file in enumerate(src_files)}
+    results.sort(key=lambda result: order[result["file"]])
+    tested, failed, errors = totals(results)
+    print('{0} files; {1} tested; {2} failed; {3} errors ({4:.2f}s).'.format(
+          len(results), tested, failed, errors, seconds))
+    if junit:
+        write_junit(results, seconds, junit, budget)
+    if json_path:
+        write_json(results, seconds, json_path)
+    if failed or errors:
+        sys.exit(1)
+
+@main
+def run_tests(*argv):
+    """Run a read-eval loop that reads from each test file and collects
+    outputs."""
+    parser = argparse.ArgumentParser(description="Run Scheme test files.")
+    parser.add_argument("files", nargs="*", default=["tests.scm"],
+                        help="test files or glob patterns")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="optimize each form before evaluating it")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="files tested at a time (default: all cores)")
+    parser.add_argument("--timeout", type=float,
+                        help="seconds allowed for each file")
+    parser.add_argument("--slowest", type=int, default=0, metavar="N",
+                        help="list the N slowest forms of each file")
+    parser.add_argument("--budget", type=float, metavar="SECONDS",
+                        help="fail any form that takes longer than SECONDS")
+    parser.add_argument("--junit", metavar="FILE",
+                        help="write results as JUnit XML to FILE")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write results as JSON to FILE")
+    args = parser.parse_args(argv)
+    src_files = expand_patterns(args.files)
+    if len(src_files) > 1 or args.timeout or args.junit or args.json:
+        return run_many(src_files, max(1, args.jobs), args.timeout,
+                        args.slowest, args.budget, args.optimize, args.junit,
+                        args.json)
+    reader = TestReader(open(src_files[0]).readlines())
+    times = [] if args.slowest or args.budget is not None else None
+    try:
+        output = run_file(reader, times, args.optimize)
     except BaseException as exc:
-        sys.stderr = sys.__stderr__
         print("Tests terminated due to unhandled exception "
               "after line {0}:\n>>>".format(reader.line_number),
               file=sys.stderr)
         raise
-    output = sys.stdout.getvalue().split('\n')
-    sys.stdout = sys.__stdout__  # Revert stdout
-    summarize(output, reader.expected_output)
+    slow = over_budget(times or [], args.budget)
+    summarize(output, reader.expected_output, slow, args.budget)
+    for line in slowest_lines(slowest_forms(times or [], args.slowest,
+                                            reader.lines)):
+        print(line)
@@ -4,10 +4,13 @@ of tokens.  A token may be:
 
   * A number (represented as an int or float)
   * A boolean (represented as a bool)
-  * A symbol (represented as a string)
-  * A delimiter, including parentheses, dots, and single quotes
+  * A symbol (represented as a Symbol, an interned string)
+  * A string (represented as a String)
+  * A delimiter, including parentheses, dots, quotes, backquotes, commas,
+    the ,@ that splices an unquoted list, and the #( that opens a vector
 """
 
+import itertools
 import string
 import sys
 
@@ -15,9 +18,89 @@ _SYMBOL_STARTS = set('!$%&*/:<=>?@^_~') | set(string.ascii_lowercase)
 _SYMBOL_INNERS = _SYMBOL_STARTS | set(string.digits) | set('+-.')
 _NUMERAL_STARTS = set(string.digits) | set('+-.')
 _WHITESPACE = set(' \t\n\r')
-_SINGLE_CHAR_TOKENS = set("()'")
-_TOKEN_END = _WHITESPACE | _SINGLE_CHAR_TOKENS
-DELIMITERS = _SINGLE_CHAR_TOKENS | {'.'}
+_SINGLE_CHAR_TOKENS = set("()'`,")
+_TOKEN_END = _WHITESPACE | _SINGLE_CHAR_TOKENS | {'"'}
+_ESCAPES = {'n': '\n', 't': '\t'}
+_WRITTEN = str.maketrans({'"': '\\"', '\\': '\\\\', '\n': '\\n', '\t': '\\t'})
+DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', '#(', ',@'}
+
+class Symbol(str):
+    """A Scheme symbol.  Symbols are interned in a global symbol table, so
+    that symbols with the same name are the same object and can be compared
+    by identity.  Each symbol has a small integer id, in order of creation.
+
+    >>> Symbol('car') is Symbol('car')
+    True
+    >>> Symbol('car').id < Symbol('a-new-symbol').id
+    True
+    """
+
+    table = {}
+    _ids = itertools.count()
+
+    def __new__(cls, name):
+        symbol = Symbol.table.get(name)
+        if symbol is None:
+            symbol = Symbol.table[str(name)] = Symbol.uninterned(name)
+        return symbol
+
+    @staticmethod
+    def uninterned(name):
+        """A new symbol named NAME that is not in the symbol table."""
+        symbol = str.__new__(Symbol, name)
+        symbol.id = next(Symbol._ids)
+        return symbol
+
+    def __reduce__(self):
+        return (Symbol, (str(self),))
+
+class String(object):
+    """A Scheme string, an immutable sequence of characters stored in the
+    Python str text.
+
+    >>> s = String('say "hi"\\n')
+    >>> s
+    String('say "hi"\\n')
+    >>> print(s)
+    "say \\"hi\\"\\n"
+    >>> len(s)
+    9
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return "String({0})".format(repr(self.text))
+
+    def __str__(self):
+        return '"' + self.text.translate(_WRITTEN) + '"'
+
+    def __len__(self):
+        return len(self.text)
+
+def read_string(text):
+    """The String written as the token TEXT, which includes its quotes.
+
+    >>> read_string(r'"a\\tb\\"c\\\\"')
+    String('a\\tb"c\\\\')
+    >>> read_string(r'"a\\"')
+    Traceback (most recent call last):
+        ...
+    ValueError: unterminated string: "a\\"
+    """
+    chars, k = [], 1
+    while k < len(text) and text[k] != '"':
+        c = text[k]
+        if c == '\\' and k + 1 < len(text):
+            k += 1
+            c = _ESCAPES.get(text[k], text[k])
+        chars.append(c)
+        k += 1
+    if k != len(text) - 1:
+        raise ValueError("unterminated string: {0}".format(text))
+    return String("".join(chars))
 
 def valid_symbol(s):
     """Returns whether s is not a well-formed value."""
@@ -39,10 +122,17 @@ def next_candidate_token(line, k):
             return None, len(line)
         elif c in _WHITESPACE:
             k += 1
+        elif c == ',' and line[k+1:k+2] == '@':
+            return ',@', k+2
         elif c in _SINGLE_CHAR_TOKENS:
             return c, k+1
-        elif c == '#':  # Boolean values #t and #f
+        elif c == '#':  # Boolean values #t and #f, and vectors #(
             return line[k:k+2], min(k+2, len(line))
+        elif c == '"':
+            j = k + 1
+            while j < len(line) and line[j] != '"':
+                j += 2 if line[j] == '\\' else 1
+            return line[k:j+1], min(j+1, len(line))
         else:
             j = k
             while j < len(line) and line[j] not in _TOKEN_END:
@@ -50,31 +140,41 @@ def next_candidate_token(line, k):
             return line[k:j], min(j, len(line))
     return None, len(line)
 
+def make_token(text):
+    """The token written as TEXT, a candidate token from next_candidate_token,
+    or None if TEXT is not a valid token."""
+    if text in DELIMITERS:
+        return text
+    elif text[0] == '"':
+        return read_string(text)
+    elif text == '+' or text == '-' or text == '...':
+        return Symbol(text)
+    elif text == '#t' or text.lower() == 'true':
+        return True
+    elif text == '#f' or text.lower() == 'false':
+        return False
+    elif text == 'nil':
+        return text
+    elif text[0] in _NUMERAL_STARTS:
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                raise ValueError("invalid numeral: {0}".format(text))
+    elif text[0] in _SYMBOL_STARTS and valid_symbol(text):
+        return Symbol(text)
+    return None
+
 def tokenize_line(line):
     """The list of Scheme tokens on line.  Excludes comments and whitespace."""
     result = []
     text, i = next_candidate_token(line, 0)
     while text is not None:
-        if text in DELIMITERS:
-            result.append(text)
-        elif text == '+' or text == '-':
-            result.append(text)
-        elif text == '#t' or text.lower() == 'true':
-            result.append(True)
-        elif text == '#f' or text.lower() == 'false':
-            result.append(False)
-        elif text == 'nil':
-            result.append(text)
-        elif text[0] in _NUMERAL_STARTS:
-            try:
-                result.append(int(text))
-            except ValueError:
-                try:
-                    result.append(float(text))
-                except ValueError:
-                    raise ValueError("invalid numeral: {0}".format(text))
-        elif text[0] in _SYMBOL_STARTS and valid_symbol(text):
-            result.append(text)
+        token = make_token(text)
+        if token is not None:
+            result.append(token)
         else:
             print("warning: invalid token: {0}".format(text), file=sys.stderr)
             print("    ", line, file=sys.stderr)
@@ -67,6 +67,18 @@ wooo
 (or #t (/ 1 0) hello)
 ; expect True
 
+;; Closures see later defines in their enclosing frames
+(define (h) (define k 1) (define (get) k) (define k 10) (get))
+(h)
+; expect 10
+
+(define (h2 k) (define (get) k) (define k 10) (get))
+(h2 1)
+; expect 10
+
+(let ((k 1)) (define (get) k) (define k 10) (get))
+; expect 10
+
 (define f (mu (strawberry) (+ strawberry lemonade)))
 (define g (lambda (strawberry lemonade) (f (+ strawberry strawberry))))
 (g 3 7)
@@ -708,3 +720,778 @@ one-through-four
     (sum (- n 1) (+ n total))))
 (sum 1001 0)
 ; expect 501501
+
+;;; Vectors
+
+(define v (make-vector 3 0))
+(vector-set! v 0 'a)
+v
+; expect #(a 0 0)
+
+(vector-ref #(1 (2 3) 4) 1)
+; expect (2 3)
+
+(vector-length (vector 1 2 3 4))
+; expect 4
+
+(vector->list (list->vector '(1 2 3)))
+; expect (1 2 3)
+
+(vector-fill! v #t)
+v
+; expect #(True True True)
+
+(eq? v v)
+; expect True
+
+(eq? v (vector #t #t #t))
+; expect False
+
+(vector-ref v 3)
+; expect Error
+
+;;; Numeric vectors
+
+(define a (f64vector 1 2 3))
+(define b (list->f64vector '(0.5 0.5 0.5)))
+a
+; expect #f64(1.0 2.0 3.0)
+
+(f64vector-map + a b)
+; expect #f64(1.5 2.5 3.5)
+
+(f64vector-map - a)
+; expect #f64(-1.0 -2.0 -3.0)
+
+(f64vector-map (lambda (x y) (* x x y)) a b)
+; expect #f64(0.5 2.0 4.5)
+
+(f64vector-sum a)
+; expect 6
+
+(f64vector-dot a b)
+; expect 3
+
+(f64vector-scale a 2)
+; expect #f64(2.0 4.0 6.0)
+
+(define c (make-s64vector 3 7))
+(s64vector-set! c 1 -2)
+(s64vector->list c)
+; expect (7 -2 7)
+
+(s64vector-sum (s64vector-map * c c))
+; expect 102
+
+(s64vector-set! c 0 1.5)
+; expect Error
+
+(s64vector-map / (s64vector 4 -6) (s64vector 2 3))
+; expect #s64(2 -2)
+
+(make-s32vector 1 5000000000)
+; expect Error
+
+(f64vector-map + a (f64vector 1))
+; expect Error
+
+(define d (f64vector 1 2 3 4))
+(define d-tail (f64vector-slice d 2))
+(f64vector-set! d 3 10)
+d-tail
+; expect #f64(3.0 10.0)
+
+(s32vector-sum (s32vector-slice (s32vector 1 2 3 4) 1 3))
+; expect 5
+
+(mmap-f64vector 'no-such-file.bin)
+; expect Error
+
+; Each group of four bytes reads the same in either byte order
+(define mm-file (temporary-file-name ".bin"))
+(with-output-to-file mm-file (lambda () (display "AAAABBBBCCCC@@@@@@@@")))
+(mmap-s32vector mm-file)
+; expect #s32(1094795585 1111638594 1128481603 1077952576 1077952576)
+
+(mmap-s32vector mm-file 4 2)
+; expect #s32(1111638594 1128481603)
+
+(mmap-f64vector mm-file 12)
+; expect #f64(32.501960784313724)
+
+(s32vector-sum (mmap-s32vector mm-file 0 3))
+; expect 3334915782
+
+(mmap-s32vector mm-file 16 2)
+; expect Error
+
+(delete-file mm-file)
+
+;;; Hash tables
+
+(define h (make-hash-table))
+(hash-table-set! h 'a 1)
+(hash-table-set! h '(b c) 2)
+(hash-table-set! h #t 3)
+(hash-table-ref h (list 'b 'c))
+; expect 2
+
+(hash-table-ref/default h 1 'none)
+; expect none
+
+(hash-table-ref h 'z (lambda () 'missing))
+; expect missing
+
+(hash-table-ref h 'z)
+; expect Error
+
+(hash-table-ref h)
+; expect Error
+
+(hash-table-ref h 'a (lambda () 'missing) 'extra)
+; expect Error
+
+(hash-table-update!/default h 'a (lambda (x) (+ x 10)) 0)
+(hash-table-update!/default h 'd (lambda (x) (+ x 10)) 0)
+(hash-table->alist h)
+; expect ((a . 11) ((b c) . 2) (True . 3) (d . 10))
+
+(hash-table-delete! h #t)
+(hash-table-count h)
+; expect 3
+
+(define inverse (make-hash-table))
+(hash-table-walk h (lambda (k v) (hash-table-set! inverse v k)))
+(hash-table-ref inverse 2)
+; expect (b c)
+
+(hash-table-values h)
+; expect (11 2 10)
+
+(define e (make-hash-table eq?))
+(hash-table-set! e '(1) 'x)
+(hash-table-contains? e '(1))
+; expect False
+
+(hash-table-ref/default (make-hash-table eq?) #t 'no)
+; expect no
+
+;;; List library
+
+(fold cons nil '(1 2 3))
+; expect (3 2 1)
+
+(fold-right cons nil '(1 2 3))
+; expect (1 2 3)
+
+(reduce + 0 (iota 5 1))
+; expect 15
+
+(remove odd? '(1 2 3 4 5))
+; expect (2 4)
+
+(assoc '(b) '((a 1) ((b) 2)))
+; expect ((b) 2)
+
+(assq 'c '((a 1)))
+; expect False
+
+(member 3 '(1 2 3 4))
+; expect (3 4)
+
+(reverse '(1 (2 3) 4))
+; expect (4 (2 3) 1)
+
+(list-ref '(a b c) 2)
+; expect c
+
+(list-ref '(a b c) 3)
+; expect Error
+
+(for-each (lambda (x y) (display (* x y))) '(1 2 3) '(4 5 6))
+(newline)
+; expect 41018
+
+(length (fold-right cons nil (iota 10000)))
+; expect 10000
+
+;;; Sorting
+
+(sort '(3 1 2 5 4) <)
+; expect (1 2 3 4 5)
+
+(sort #(3 1 2) >)
+; expect #(3 2 1)
+
+(sort '((b . 2) (a . 1) (c . 2) (d . 1)) (lambda (x y) (< (cdr x) (cdr y))))
+; expect ((a . 1) (d . 1) (b . 2) (c . 2))
+
+(define sv (vector 5 3 9))
+(sort! sv (lambda (x y) (> x y)))
+sv
+; expect #(9 5 3)
+
+(list-sort < '(2 3 1))
+; expect (1 2 3)
+
+(sort '(1 a) <)
+; expect Error
+
+;;; Memoization
+
+(define-memoized (fib n)
+  (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(fib 80)
+; expect 23416728348467685
+
+(memo-stats fib)
+; expect ((hits . 78) (misses . 81) (entries . 81))
+
+(assq 'hits (memo-stats fib))
+; expect (hits . 78)
+
+(symbol? (car (car (memo-stats fib))))
+; expect True
+
+(define-memoized (cc amount coins)
+  (cond ((= amount 0) 1)
+        ((or (< amount 0) (null? coins)) 0)
+        (else (+ (cc amount (cdr coins)) (cc (- amount (car coins)) coins)))))
+(cc 100 '(50 25 10 5 1))
+; expect 292
+
+(define square-lru (memoize (lambda (x) (* x x)) 2))
+(square-lru 2)
+; expect 4
+(square-lru 3)
+; expect 9
+(square-lru 4)
+; expect 16
+(square-lru 2)
+; expect 4
+(memo-stats square-lru)
+; expect ((hits . 0) (misses . 4) (entries . 2))
+
+(memoize square-lru 0)
+; expect Error
+
+;;; Streams
+
+(define (integers-from n) (cons-stream n (integers-from (+ n 1))))
+(define naturals (integers-from 0))
+(stream-ref naturals 500)
+; expect 500
+
+(stream->list (stream-filter (lambda (x) (= (modulo x 100) 0)) naturals) 3)
+; expect (0 100 200)
+
+(stream->list (stream-map * naturals naturals) 4)
+; expect (0 1 4 9)
+
+(stream->list (stream-take naturals 3))
+; expect (0 1 2)
+
+(define promise (delay (begin (display 'forced) (newline) 5)))
+(force promise)
+; expect forced
+; expect 5
+(force promise)
+; expect 5
+
+(define (countdown n) (if (= n 0) (delay 'done) (delay-force (countdown (- n 1)))))
+(force (countdown 10000))
+; expect done
+
+(stream-cdr '(1 2))
+; expect Error
+
+;;; Macros
+
+(define-syntax unless
+  (syntax-rules ()
+    ((_ condition body ...) (if condition #f (begin body ...)))))
+(unless (= 1 2) (display 'ran) (newline) 'done)
+; expect ran
+; expect done
+
+(define-syntax my-or
+  (syntax-rules ()
+    ((_) #f)
+    ((_ e) e)
+    ((_ e rest ...) (let ((t e)) (if t t (my-or rest ...))))))
+(define t 5)
+(my-or #f t)
+; expect 5
+
+(define-syntax for
+  (syntax-rules (in)
+    ((_ x in items body ...) (for-each (lambda (x) body ...) items))))
+(for y in '(1 2 3) (display (* y y)))
+(newline)
+; expect 149
+
+(define (count-up n) (unless (= n 0) (count-up (- n 1))))
+(count-up 2000)
+; expect False
+
+(let-syntax ((twice (syntax-rules () ((_ e) (list e e)))))
+  (twice 3))
+; expect (3 3)
+
+(twice 3)
+; expect Error
+
+(define-syntax my-pair
+  (syntax-rules ()
+    ((_ a b) (list a b))))
+(let ((list vector)) (my-pair 1 2))
+; expect (1 2)
+
+(define (local-offset n)
+  (define-syntax add-n (syntax-rules () ((_ x) (+ x n))))
+  (let ((n 100)) (add-n 1)))
+(local-offset 5)
+; expect 6
+
+(define-syntax show-squares
+  (syntax-rules ()
+    ((_ items) (for z in items (display (* z z))))))
+(show-squares '(1 2 3))
+(newline)
+; expect 149
+
+(my-or 1 2 . 3)
+; expect Error
+
+;;; Quasiquote
+
+(define qx 5)
+(define ql '(1 2))
+`(a ,qx ,@ql b)
+; expect (a 5 1 2 b)
+
+`(a (b ,(+ qx 1)) ,@ql)
+; expect (a (b 6) 1 2)
+
+`#(1 ,qx)
+; expect #(1 5)
+
+`(1 `(2 ,(3 ,qx)))
+; expect (1 (quasiquote (2 (unquote (3 5)))))
+
+(define (template y) `(head (constant tail) ,y))
+(eq? (car (cdr (template 1))) (car (cdr (template 2))))
+; expect True
+
+`(1 . ,qx)
+; expect (1 . 5)
+
+`(,@qx 1)
+; expect Error
+
+;;; Closures
+
+(define (make-offset n)
+  (define (shift x) (+ x n))
+  (lambda (x) (shift (shift x))))
+((make-offset 3) 1)
+; expect 7
+
+(define (parity n)
+  (define (ev? k) (if (= k 0) True (od? (- k 1))))
+  (define (od? k) (if (= k 0) False (ev? (- k 1))))
+  (ev? n))
+(parity 10)
+; expect True
+
+(define (scaled-pair x)
+  (let ((y (* x 2)))
+    (lambda (z) (list x y z))))
+((scaled-pair 1) 3)
+; expect (1 2 3)
+
+(define (evaluator x) (lambda () (eval 'x)))
+((evaluator 7))
+; expect 7
+
+(define my-eval eval)
+(define (aliased-evaluator x) (lambda () (my-eval 'x)))
+((aliased-evaluator 2))
+; expect 2
+
+(define-syntax def (syntax-rules () ((_ n v) (define n v))))
+(define (macro-defines) (define (get) (late)) (def late (lambda () 1)) (get))
+(macro-defines)
+; expect 1
+
+(def macro-global 1)
+(define (get-macro-global) macro-global)
+(def macro-global 2)
+(get-macro-global)
+; expect 2
+
+(define fm (mu () y))
+(define (gm y) ((lambda () (fm))))
+(gm 5)
+; expect 5
+
+(define (late-mu x) (lambda () (late-body)))
+(define late-thunk (late-mu 5))
+(define late-body (mu () x))
+(late-thunk)
+; expect 5
+
+;;; Frame reuse
+
+(define (thunks i acc)
+  (if (= i 0) acc (thunks (- i 1) (cons (lambda () (eval 'i)) acc))))
+(define ts (thunks 3 nil))
+(list ((car ts)) ((car (cdr ts))) ((car (cdr (cdr ts)))))
+; expect (1 2 3)
+
+(define (promises i acc)
+  (if (= i 0) acc (promises (- i 1) (cons (delay i) acc))))
+(force (car (cdr (promises 3 nil))))
+; expect 2
+
+(define (count-down i) (let ((j (- i 1))) (if (= j 0) 'done (count-down j))))
+(count-down 5)
+; expect done
+
+(let ((a 1) (a 2)) a)
+; expect Error
+
+;;; Symbols
+
+(eq? 'abc (car '(abc def)))
+; expect True
+
+(eq? '(abc) '(abc))
+; expect False
+
+(eq? 100000000000 100000000000)
+; expect True
+
+(define lambda-count 2)
+(+ lambda-count 1)
+; expect 3
+
+;;; Strings
+
+"a \"quoted\" word"
+; expect "a \"quoted\" word"
+
+"a\"
+; expect Error
+
+"a\\"
+; expect "a\\"
+
+(string-append "con" "cat" "enate")
+; expect "concatenate"
+
+(substring "scheme" 1 4)
+; expect "che"
+
+(string-length "")
+; expect 0
+
+(eq? (string->symbol "abc") 'abc)
+; expect True
+
+(string->number (number->string 2.5))
+; expect 2.5
+
+(string<? "apple" "banana" "cherry")
+; expect True
+
+(string-ref "abc" 3)
+; expect Error
+
+(define report (open-output-string))
+(display "total: " report)
+(display (+ 1 2) report)
+(newline report)
+(get-output-string report)
+; expect "total: 3\n"
+
+(begin (display "plain") (newline))
+; expect plain
+
+;;; Output ports
+
+(with-output-to-string (lambda () (display "x") (write "y") (newline)))
+; expect "x\"y\"\n"
+
+(begin (display "first") (newline) (display "second") (newline))
+; expect first
+; expect second
+
+(define port (open-output-string))
+(write-char "z" port)
+(write 'sym port)
+(get-output-string port)
+; expect "zsym"
+
+(write-char "zz")
+; expect Error
+
+(output-port? (current-output-port))
+; expect True
+
+;;; Printing
+
+(define cyclic (list 1 2 3))
+(set-cdr! (cdr (cdr cyclic)) cyclic)
+cyclic
+; expect #0=(1 2 3 . #0#)
+
+(define nested (list 1 2))
+(set-car! (cdr nested) nested)
+nested
+; expect #0=(1 #0#)
+
+(define c (list 'a))
+(set-cdr! c c)
+(define big (list (list 1 2) (list 3 4) (list 5 6) c))
+big
+; expect ((1 2) (3 4) (5 6) #0=(a . #0#))
+
+(print-length 2)
+'(1 2 3 4)
+; expect (1 2 ...)
+
+(print-length False)
+(print-depth 2)
+'(1 (2 (3)) #(4 #(5)))
+; expect (1 (2 #) #(4 #))
+
+(print-depth False)
+(display (list "a" 'b))
+(newline)
+; expect (a b)
+
+;;; Input ports
+
+(define in (open-input-string "(1 (2)) sym \"text\"\nnext line\nz"))
+(read in)
+; expect (1 (2))
+
+(read in)
+; expect sym
+
+(peek-char in)
+; expect " "
+
+(read in)
+; expect "text"
+
+(read-line in)
+; expect ""
+
+(read-line in)
+; expect "next line"
+
+(read-char in)
+; expect "z"
+
+(eof-object? (read in))
+; expect True
+
+(read (open-input-string "(unclosed"))
+; expect Error
+
+;;; Data files
+
+(define csv-file (temporary-file-name ".csv"))
+(with-output-to-file csv-file
+  (lambda () (display "item,qty\nbolt,4\n\"nut, hex\",2.5\nnan,1_000\n")))
+(csv-fold (lambda (row total) (+ total (hash-table-ref row 'qty)))
+          0 csv-file True)
+; expect Error
+
+(csv-fold cons nil csv-file)
+; expect (#("nan" "1_000") #("nut, hex" 2.5) #("bolt" 4) #("item" "qty"))
+
+(with-output-to-file csv-file (lambda () (display "\"a\"b,c\n1,2\n")))
+(csv-fold cons nil csv-file True)
+; expect Error
+
+(with-output-to-file csv-file (lambda () (display "a,b\n1,2,3\n")))
+(csv-fold (lambda (row n) (+ n 1)) 0 csv-file True)
+; expect Error
+
+(delete-file csv-file)
+(file-exists? csv-file)
+; expect False
+
+(define jsonl-file (temporary-file-name ".jsonl"))
+(with-output-to-file jsonl-file
+  (lambda () (display "{\"n\": 1, \"xs\": [1, 2]}\n{\"n\": 2, \"xs\": []}\n")))
+(jsonl-fold (lambda (r acc) (cons (hash-table-ref r 'xs) acc))
+            nil jsonl-file)
+; expect (#() #(1 2))
+
+(delete-file jsonl-file)
+(delete-file jsonl-file)
+; expect Error
+
+;;; Hash consing
+
+(hash-consing True)
+(define shared-rules '((rule (a b) (c d)) (rule (a b) (e f)) (c d)))
+(eq? (car (cdr (car shared-rules))) (car (cdr (car (cdr shared-rules)))))
+; expect True
+
+(eq? (car (cdr (cdr (car shared-rules)))) (car (cdr (cdr shared-rules))))
+; expect True
+
+(hash-consing)
+; expect (19 14)
+
+(set-car! (car shared-rules) 'fact)
+; expect Error
+
+(eq? (read (open-input-string "(1 2)")) (read (open-input-string "(1 2)")))
+; expect True
+
+(hash-consing False)
+(eq? '(a b) '(a b))
+; expect False
+
+(hash-consing)
+; expect False
+
+;;; Compact lists
+
+(define cl (list 1 2 3 4))
+(eq? (cdr cl) (cdr cl))
+; expect True
+
+(eq? (list-tail cl 2) (cdr (cdr cl)))
+; expect True
+
+(list (length cl) (list-ref cl 3) (list-tail cl 4))
+; expect (4 4 ())
+
+(define cl-tail (cdr cl))
+(set-car! cl-tail 'two)
+cl
+; expect (1 two 3 4)
+
+(set-cdr! (cdr (cdr cl)) '(5 6 7))
+(list cl (length cl) (list-ref cl 4) (list? cl))
+; expect ((1 two 3 5 6 7) 6 6 True)
+
+(define cl-literal '(a (b c) . d))
+(set-car! (car (cdr cl-literal)) 'x)
+cl-literal
+; expect (a (x c) . d)
+
+(list-ref '(1 2) 2)
+; expect Error
+
+;;; Parallel map
+
+(define (pm-square x) (* x x))
+(define pm-offset 10)
+(define (pm-score x) (+ pm-offset (pm-square x)))
+(pmap pm-score '(1 2 3 4 5))
+; expect (11 14 19 26 35)
+
+(define (pm-scaler k) (lambda (x) (* k (pm-score x))))
+(pmap (pm-scaler 2) (list 1 2 3) 1)
+; expect (22 28 38)
+
+(preduce + 0 (list 1 2 3 4 5 6 7 8 9 10) 3)
+; expect 55
+
+(preduce + 0 nil)
+; expect 0
+
+(pmap car '(1 2))
+; expect Error
+
+(pmap pm-square '(1 2) 0)
+; expect Error
+
+(define pm-promise (delay 1))
+(pmap (lambda (x) pm-promise) '(1))
+; expect Error
+
+(pmap even? '(1 2))
+; expect (False True)
+
+(pmap (lambda (x) (even? x)) '(1 2))
+; expect (False True)
+
+(pmap (lambda (x) (eval (list 'pm-square x))) '(3 4))
+; expect (9 16)
+
+(pmap (lambda (x) 5) '(1 2))
+; expect (5 5)
+
+(pmap (lambda (pm-offset) pm-offset) '(1 2))
+; expect (1 2)
+
+;;; Futures
+
+(define (fu-fib n) (if (< n 2) n (+ (fu-fib (- n 1)) (fu-fib (- n 2)))))
+(define (fu-start k) (let ((base 100)) (future (+ base k (fu-fib 10)))))
+(define fu (fu-start 1))
+(future? fu)
+; expect True
+
+(touch fu)
+; expect 156
+
+(list (future-done? fu) (future-cancel fu))
+; expect (True False)
+
+(touch 5)
+; expect 5
+
+(touch (future (car nil)))
+; expect Error
+
+(touch (future (even? 4)))
+; expect True
+
+(define fu-answer (future (* 6 7)))
+(touch (future (touch fu-answer)))
+; expect Error
+
+(touch fu-answer)
+; expect 42
+
+(touch (future (touch (future (car nil)))))
+; expect Error
+
+(future-done? 5)
+; expect Error
+
+;;; Optimization
+
+(optimize '(* 2 3.5 10))
+; expect 70
+
+(optimize '(lambda (x) (if (< 1 2) (+ x (* 2 3)) (f))))
+; expect (lambda (x) (+ x 6))
+
+(optimize '(cond ((odd? 2) a) ((= 1 1) b c) (else d)))
+; expect (begin b c)
+
+(define saved-ceil ceil)
+(optimize '(ceil 2.5))
+; expect 3
+
+(define (ceil x) (display "mine ") x)
+(optimize '(ceil 2.5))
+; expect (ceil 2.5)
+
+(ceil 2.5)
+; expect mine 2.5
+
+(define ceil saved-ceil)
+(optimize '(ceil 2.5))
+; expect 3